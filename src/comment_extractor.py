@@ -38,6 +38,24 @@ except ImportError:
 # Set up logger
 logger = get_logger(__name__)
 
+# Primary pattern for file-specific comments with code suggestions
+_PRIMARY_COMMENT_PATTERN = re.compile(
+    r'### ([^:\n]+):(\d+)\s*\n(.*?)(?=\n### [^:\n]+:\d+|\Z)', re.DOTALL
+)
+
+# Alternative patterns to try when few primary comments are found
+_ALTERNATIVE_COMMENT_PATTERNS = [
+    # "In file X, line Y:" format
+    re.compile(r'(?:^|\n)(?:In|At) ([^,\n]+),\s*line (\d+):(.*?)(?=\n(?:In|At) [^,\n]+,\s*line \d+:|\Z)', re.DOTALL),
+    # "filename.ext line Y:" format
+    re.compile(r'(?:^|\n)([^:\s\n]+)\s+line\s+(\d+):(.*?)(?=\n[^:\s\n]+\s+line\s+\d+:|\Z)', re.DOTALL),
+    # "File: filename.ext, Line: Y" format
+    re.compile(r'(?:^|\n)File:\s*([^,\n]+),\s*Line:\s*(\d+)(.*?)(?=\n(?:File:|In|At)|\Z)', re.DOTALL)
+]
+
+# Leading colon left over after a "file:line" marker
+_LEADING_COLON_PATTERN = re.compile(r'^:\s*')
+
 
 class CommentExtractor:
     """
@@ -147,8 +165,10 @@ class CommentExtractor:
         if file_path not in file_line_map:
             return False
             
-        # Check if the line number exists in the file's diff
-        return any(line == line_num for line, _, _ in file_line_map[file_path])
+        # Check if the line number exists in the file's diff. Only the first
+        # field of each entry is read, so (line, position) pairs work as well
+        # as the (line, position, content) tuples of parse_diff_for_lines.
+        return any(entry[0] == line_num for entry in file_line_map[file_path])
 
     @with_context
     def match_comment_patterns(self, review_text: str) -> List[Dict[str, Any]]:
@@ -179,10 +199,10 @@ class CommentExtractor:
                         "match": match
                     })
                 except (IndexError, ValueError) as e:
-                    self.logger.warning(f"Failed to extract match from pattern {i}: {e}",
+                    self.logger.warning("Failed to extract match from pattern %d: %s", i, e,
                                       context={"pattern": self.patterns[i], "match_text": match.group(0)})
         
-        self.logger.debug(f"Found {len(matches)} potential comments in review", 
+        self.logger.debug("Found %d potential comments in review", len(matches),
                          context={"matches_count": len(matches)})
         return matches
 
@@ -203,10 +223,9 @@ class CommentExtractor:
         # Search for the next pattern match
         next_match_pos = float('inf')
         for pattern in self.compiled_patterns:
-            next_pattern_match = pattern.search(review_text[start_pos:], re.MULTILINE)
+            next_pattern_match = pattern.search(review_text, start_pos)
             if next_pattern_match:
-                current_match_pos = start_pos + next_pattern_match.start()
-                next_match_pos = min(next_match_pos, current_match_pos)
+                next_match_pos = min(next_match_pos, next_pattern_match.start())
         
         # Extract comment text
         if next_match_pos != float('inf'):
@@ -215,7 +234,7 @@ class CommentExtractor:
             comment_text = review_text[start_pos:].strip()
         
         # Clean up the comment text by removing leading colons
-        comment_text = re.sub(r'^:\s*', '', comment_text)
+        comment_text = _LEADING_COLON_PATTERN.sub('', comment_text)
         
         return comment_text
 
@@ -243,14 +262,11 @@ class CommentExtractor:
             comments = []
             
             # Log the available files in the diff for debugging
-            self.logger.debug(f"Available files in diff: {list(file_line_map.keys())}")
-            
-            # Primary pattern for file-specific comments with code suggestions
-            primary_pattern = r'### ([^:\n]+):(\d+)\s*\n(.*?)(?=\n### [^:\n]+:\d+|\Z)'
+            self.logger.debug("Available files in diff: %s", list(file_line_map.keys()))
             
             # Try to find all file-specific comments with the primary pattern
-            primary_matches = list(re.finditer(primary_pattern, review_text, re.DOTALL))
-            self.logger.debug(f"Found {len(primary_matches)} primary file-specific comments")
+            primary_matches = list(_PRIMARY_COMMENT_PATTERN.finditer(review_text))
+            self.logger.debug("Found %d primary file-specific comments", len(primary_matches))
             
             # Process primary matches first (these are the most reliable)
             for match in primary_matches:
@@ -258,18 +274,18 @@ class CommentExtractor:
                 line_num = int(match.group(2))
                 content = match.group(3).strip()
                 
-                self.logger.debug(f"Processing primary file-specific comment: {file_path}:{line_num}")
+                self.logger.debug("Processing primary file-specific comment: %s:%s", file_path, line_num)
                 
                 # Check if the file exists in the diff
                 if not self.validate_file_path(file_path, file_line_map):
-                    self.logger.warning(f"File {file_path} not found in diff, checking for similar files")
+                    self.logger.warning("File %s not found in diff, checking for similar files", file_path)
                     # Try to find a similar file name
                     similar_files = [f for f in file_line_map.keys() if f.endswith(file_path) or file_path.endswith(f)]
                     if similar_files:
                         file_path = similar_files[0]
-                        self.logger.info(f"Using similar file {file_path} instead")
+                        self.logger.info("Using similar file %s instead", file_path)
                     else:
-                        self.logger.warning(f"No similar file found for {file_path}, skipping comment")
+                        self.logger.warning("No similar file found for %s, skipping comment", file_path)
                         continue
                         
                 # GitHub API requires 'line' and 'side' parameters - do not use 'position'
@@ -281,41 +297,31 @@ class CommentExtractor:
                 }
                 
                 comments.append(comment_data)
-                self.logger.debug(f"Added comment for {file_path}:{line_num}")
+                self.logger.debug("Added comment for %s:%s", file_path, line_num)
                 
             # Try alternative patterns if we didn't find enough primary matches
             if len(primary_matches) < 3:
-                # Alternative patterns to try
-                alternative_patterns = [
-                    # "In file X, line Y:" format
-                    r'(?:^|\n)(?:In|At) ([^,\n]+),\s*line (\d+):(.*?)(?=\n(?:In|At) [^,\n]+,\s*line \d+:|\Z)',
-                    # "filename.ext line Y:" format
-                    r'(?:^|\n)([^:\s\n]+)\s+line\s+(\d+):(.*?)(?=\n[^:\s\n]+\s+line\s+\d+:|\Z)',
-                    # "File: filename.ext, Line: Y" format
-                    r'(?:^|\n)File:\s*([^,\n]+),\s*Line:\s*(\d+)(.*?)(?=\n(?:File:|In|At)|\Z)'
-                ]
-                
-                for pattern_idx, pattern in enumerate(alternative_patterns):
-                    alt_matches = list(re.finditer(pattern, review_text, re.DOTALL))
-                    self.logger.debug(f"Found {len(alt_matches)} matches with alternative pattern {pattern_idx+1}")
+                for pattern_idx, pattern in enumerate(_ALTERNATIVE_COMMENT_PATTERNS):
+                    alt_matches = list(pattern.finditer(review_text))
+                    self.logger.debug("Found %d matches with alternative pattern %d", len(alt_matches), pattern_idx + 1)
                     
                     for match in alt_matches:
                         file_path = match.group(1).strip()
                         line_num = int(match.group(2))
                         content = match.group(3).strip()
                         
-                        self.logger.debug(f"Processing alternative match: {file_path}:{line_num}")
+                        self.logger.debug("Processing alternative match: %s:%s", file_path, line_num)
                         
                         # Check if the file exists in the diff
                         if not self.validate_file_path(file_path, file_line_map):
-                            self.logger.warning(f"File {file_path} not found in diff, checking for similar files")
+                            self.logger.warning("File %s not found in diff, checking for similar files", file_path)
                             # Try to find a similar file name
                             similar_files = [f for f in file_line_map.keys() if f.endswith(file_path) or file_path.endswith(f)]
                             if similar_files:
                                 file_path = similar_files[0]
-                                self.logger.info(f"Using similar file {file_path} instead")
+                                self.logger.info("Using similar file %s instead", file_path)
                             else:
-                                self.logger.warning(f"No similar file found for {file_path}, skipping comment")
+                                self.logger.warning("No similar file found for %s, skipping comment", file_path)
                                 continue
                                 
                         # GitHub API requires 'line' and 'side' parameters - do not use 'position'
@@ -327,7 +333,7 @@ class CommentExtractor:
                         }
                         
                         comments.append(comment_data)
-                        self.logger.debug(f"Added comment for {file_path}:{line_num}")
+                        self.logger.debug("Added comment for %s:%s", file_path, line_num)
             
             # Process standard pattern matches
             for match in matches:
@@ -336,7 +342,7 @@ class CommentExtractor:
                 
                 # Skip if we already have a comment for this file and line
                 if any(c["path"] == file_path and c["line"] == line_num for c in comments):
-                    self.logger.debug(f"Skipping duplicate comment for {file_path}:{line_num}")
+                    self.logger.debug("Skipping duplicate comment for %s:%s", file_path, line_num)
                     continue
                 
                 # Extract comment text
@@ -344,14 +350,14 @@ class CommentExtractor:
                 
                 # Validate file path
                 if not self.validate_file_path(file_path, file_line_map):
-                    self.logger.warning(f"File {file_path} not found in diff, checking for similar files")
+                    self.logger.warning("File %s not found in diff, checking for similar files", file_path)
                     # Try to find a similar file name
                     similar_files = [f for f in file_line_map.keys() if f.endswith(file_path) or file_path.endswith(f)]
                     if similar_files:
                         file_path = similar_files[0]
-                        self.logger.info(f"Using similar file {file_path} instead")
+                        self.logger.info("Using similar file %s instead", file_path)
                     else:
-                        self.logger.warning(f"No similar file found for {file_path}, skipping comment")
+                        self.logger.warning("No similar file found for %s, skipping comment", file_path)
                         continue
                 
                 # GitHub API requires 'line' and 'side' parameters
@@ -363,7 +369,7 @@ class CommentExtractor:
                 }
                 
                 comments.append(comment_data)
-                self.logger.debug(f"Added comment for {file_path}:{line_num}")
+                self.logger.debug("Added comment for %s:%s", file_path, line_num)
             
             # Final validation to ensure all comments have required fields
             for comment in comments:
@@ -374,7 +380,7 @@ class CommentExtractor:
                 # Verify each comment has the GitHub-required fields
                 if "path" not in comment or "line" not in comment or "body" not in comment:
                     missing = [f for f in ["path", "line", "body"] if f not in comment]
-                    self.logger.warning(f"Comment missing required fields: {', '.join(missing)}")
+                    self.logger.warning("Comment missing required fields: %s", ', '.join(missing))
                 
                 # Ensure side is RIGHT for all comments
                 comment["side"] = "RIGHT"
@@ -383,7 +389,7 @@ class CommentExtractor:
                 if "start_line" in comment and "start_side" not in comment:
                     comment["start_side"] = "RIGHT"
             
-            self.logger.info(f"Extracted {len(comments)} line-specific comments")
+            self.logger.info("Extracted %d line-specific comments", len(comments))
             return comments
             
         except Exception as e:
@@ -111,7 +111,7 @@ class FileFilter:
         # Check for pattern matches
         for pattern in self.exclude_patterns:
             if fnmatch.fnmatch(filename, pattern):
-                self.logger.debug(f"Excluding file due to pattern match: {filename}",
+                self.logger.debug("Excluding file due to pattern match: %s", filename,
                                 context={"filename": filename, "pattern": pattern})
                 return True
         
@@ -120,7 +120,7 @@ class FileFilter:
             # Convert size from bytes to KB
             size_kb = file_info["size"] / 1024
             if size_kb > self.max_file_size:
-                self.logger.debug(f"Excluding file due to size: {filename}",
+                self.logger.debug("Excluding file due to size: %s", filename,
                                 context={"filename": filename, 
                                         "size_kb": size_kb, 
                                         "max_size_kb": self.max_file_size})
@@ -147,7 +147,7 @@ class FileFilter:
         excluded_count = original_count - len(filtered_files)
         
         if excluded_count > 0:
-            self.logger.info(f"Excluded {excluded_count} files from review",
+            self.logger.info("Excluded %d files from review", excluded_count,
                            context={"original_count": original_count, 
                                    "filtered_count": len(filtered_files)})
         
@@ -6,9 +6,35 @@ Provides a unified interface for generating responses from different AI models.
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, Any, Optional
 import logging
 
+try:
+    from utils import _json_dumps
+except ImportError:
+    from src.utils import _json_dumps
+
+
+class _ModelRetry(Retry):
+    """
+    Retry policy for model API calls.
+    
+    Generation requests are billed, so a POST is only retried when the
+    provider did not run it: when it was rate limited (HTTP 429), or when the
+    service was unavailable and said when to come back (HTTP 503 with a
+    Retry-After header). Gateway errors and read errors are not retried,
+    because the provider may already have processed the prompt.
+    """
+    
+    RETRY_AFTER_STATUS_CODES = frozenset({429, 503})
+    
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 503 and not has_retry_after:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
 
 class ModelAdapter:
     """A model-agnostic adapter to interface with different AI providers."""
@@ -23,7 +49,7 @@ class ModelAdapter:
         """
         self.provider = config["provider"].lower()
         logger = logging.getLogger("ai-pr-reviewer")
-        logger.info(f"Initializing model adapter for provider: {self.provider}")
+        logger.info("Initializing model adapter for provider: %s", self.provider)
         
         # Special handling for Anthropic to prioritize the environment variable
         if self.provider == "anthropic":
@@ -45,16 +71,32 @@ class ModelAdapter:
         
         # Log API key presence (not the actual key)
         if self.api_key:
-            logger.info(f"API key for {self.provider} is present")
+            logger.info("API key for %s is present", self.provider)
             # Log the first few characters of the key for debugging (safely)
             if len(self.api_key) > 8:
-                logger.debug(f"API key starts with: {self.api_key[:4]}...{self.api_key[-4:]}")
+                logger.debug("API key starts with: %s...%s", self.api_key[:4], self.api_key[-4:])
         else:
-            logger.error(f"API key for {self.provider} is missing")
+            logger.error("API key for %s is missing", self.provider)
             
         self.endpoint = config["endpoint"]
         self.model = config["model"]
         self.max_tokens = config.get("max_tokens", 1500)
+        # Reuse one connection pool for every call made through this adapter,
+        # retrying connection failures and throttled calls with backoff
+        self.session = requests.Session()
+        retry = _ModelRetry(
+            total=3,
+            read=0,
+            other=0,
+            backoff_factor=0.5,
+            status_forcelist=[429, 503],
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
         if not self.api_key:
             raise ValueError(f"API key for {self.provider} not found in config or environment variables")
@@ -88,6 +130,19 @@ class ModelAdapter:
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
 
+    def _post(self, payload: Dict[str, Any], headers: Dict[str, str]) -> requests.Response:
+        """
+        POST a JSON payload to the configured endpoint.
+        
+        Args:
+            payload: The request body, encoded with ``_json_dumps``
+            headers: Request headers, including the JSON content type
+            
+        Returns:
+            The HTTP response
+        """
+        return self.session.post(self.endpoint, data=_json_dumps(payload), headers=headers)
+
     def _call_openai(self, prompt: str) -> str:
         """Call OpenAI API."""
         headers = {
@@ -104,7 +159,7 @@ class ModelAdapter:
                 "max_tokens": self.max_tokens,
                 "temperature": 0.7,
             }
-            response = requests.post(self.endpoint, json=payload, headers=headers)
+            response = self._post(payload, headers)
             if response.status_code != 200:
                 raise RuntimeError(f"OpenAI API error: {response.text}")
                 
@@ -117,7 +172,7 @@ class ModelAdapter:
                 "max_tokens": self.max_tokens,
                 "temperature": 0.7,
             }
-            response = requests.post(self.endpoint, json=payload, headers=headers)
+            response = self._post(payload, headers)
             if response.status_code != 200:
                 raise RuntimeError(f"OpenAI API error: {response.text}")
                 
@@ -134,7 +189,7 @@ class ModelAdapter:
             api_key = api_key.strip().replace('\n', '').replace('\r', '')
             
         logger = logging.getLogger("ai-pr-reviewer")
-        logger.debug(f"Using API key from {'environment variable' if api_key != self.api_key else 'config'}")
+        logger.debug("Using API key from %s", 'environment variable' if api_key != self.api_key else 'config')
         
         # Verify the API key is valid
         if not api_key or len(api_key) < 8:
@@ -142,7 +197,7 @@ class ModelAdapter:
             raise RuntimeError("Anthropic API key is missing or invalid")
             
         # Log the first few characters of the key for debugging (safely)
-        logger.debug(f"API key starts with: {api_key[:4]}...{api_key[-4:]}")
+        logger.debug("API key starts with: %s...%s", api_key[:4], api_key[-4:])
         
         # Use the correct authentication header for Anthropic API
         headers = {
@@ -161,13 +216,13 @@ class ModelAdapter:
                 "temperature": 0.5  # Lower temperature for more consistent formatting
             }
             
-            response = requests.post(self.endpoint, json=payload, headers=headers)
+            response = self._post(payload, headers)
             
             # If we get a 404 error, try with the latest model
             if response.status_code == 404:
-                logger.warning(f"Model {self.model} not found, trying with claude-3-opus-latest")
+                logger.warning("Model %s not found, trying with claude-3-opus-latest", self.model)
                 payload["model"] = "claude-3-opus-latest"
-                response = requests.post(self.endpoint, json=payload, headers=headers)
+                response = self._post(payload, headers)
             
             if response.status_code != 200:
                 # Try with updated headers for newer API
@@ -176,7 +231,7 @@ class ModelAdapter:
                     "Content-Type": "application/json",
                     "anthropic-version": "2023-06-01"
                 }
-                response = requests.post(self.endpoint, json=payload, headers=headers)
+                response = self._post(payload, headers)
                 
                 if response.status_code != 200:
                     # Try with Authorization header
@@ -185,21 +240,21 @@ class ModelAdapter:
                         "Content-Type": "application/json",
                         "anthropic-version": "2023-06-01"
                     }
-                    response = requests.post(self.endpoint, json=payload, headers=headers)
+                    response = self._post(payload, headers)
                     
                     if response.status_code != 200:
                         # Log the error for debugging
-                        logger.error(f"Anthropic API error: {response.status_code} - {response.text}")
+                        logger.error("Anthropic API error: %s - %s", response.status_code, response.text)
                         raise RuntimeError(f"Anthropic API error: {response.status_code} - {response.text}")
-        except Exception as e:
-            raise RuntimeError(f"Anthropic API error: {str(e)}")
+        except requests.RequestException as e:
+            raise RuntimeError(f"Anthropic API error: {str(e)}") from e
         
         # Handle Claude 3 response format
         response_json = response.json()
         
         # Use proper logging instead of print
         logger = logging.getLogger("ai-pr-reviewer")
-        logger.debug(f"Anthropic response keys: {list(response_json.keys())}")
+        logger.debug("Anthropic response keys: %s", list(response_json.keys()))
         
         # Claude 3 format (messages API)
         if "content" in response_json:
@@ -217,7 +272,7 @@ class ModelAdapter:
                 
                 if text_parts:
                     result = "\n".join(text_parts)
-                    logger.debug(f"Extracted text from content list: {result[:100]}...")
+                    logger.debug("Extracted text from content list: %s...", result[:100])
                     return result
         
         # Try direct content access
@@ -226,17 +281,17 @@ class ModelAdapter:
             if isinstance(content_item, dict):
                 if "text" in content_item:
                     result = content_item["text"]
-                    logger.debug(f"Extracted text from content[0].text: {result[:100]}...")
+                    logger.debug("Extracted text from content[0].text: %s...", result[:100])
                     return result
                 elif "value" in content_item:
                     result = content_item["value"]
-                    logger.debug(f"Extracted text from content[0].value: {result[:100]}...")
+                    logger.debug("Extracted text from content[0].value: %s...", result[:100])
                     return result
         
         # Legacy format
         if "completion" in response_json:
             result = response_json["completion"]
-            logger.debug(f"Extracted text from completion: {result[:100]}...")
+            logger.debug("Extracted text from completion: %s...", result[:100])
             return result
         
         # Try to extract from the 'message' field if it exists
@@ -250,24 +305,24 @@ class ModelAdapter:
                             text_parts.append(item["text"])
                     if text_parts:
                         result = "\n".join(text_parts)
-                        logger.debug(f"Extracted text from message.content: {result[:100]}...")
+                        logger.debug("Extracted text from message.content: %s...", result[:100])
                         return result
                 elif isinstance(message["content"], str):
                     result = message["content"]
-                    logger.debug(f"Extracted text from message.content string: {result[:100]}...")
+                    logger.debug("Extracted text from message.content string: %s...", result[:100])
                     return result
         
         # Last resort: try to extract any text we can find
         try:
             # Log the full response for debugging
-            logger.error(f"Could not extract text using standard methods. Full response: {response_json}")
+            logger.error("Could not extract text using standard methods. Full response: %s", response_json)
             
             # Try to convert to string as a last resort
             result = str(response_json)
-            logger.debug(f"Converted full response to string: {result[:100]}...")
+            logger.debug("Converted full response to string: %s...", result[:100])
             return result
         except Exception as e:
-            logger.error(f"Error converting response to string: {str(e)}")
+            logger.error("Error converting response to string: %s", e)
             raise RuntimeError(f"Unexpected Anthropic API response format: {response_json}")
 
     def _call_google(self, prompt: str) -> str:
@@ -286,7 +341,7 @@ class ModelAdapter:
             }
         }
         
-        response = requests.post(self.endpoint, json=payload, headers=headers)
+        response = self._post(payload, headers)
         if response.status_code != 200:
             raise RuntimeError(f"Google Gemini API error: {response.text}")
             
@@ -306,7 +361,7 @@ class ModelAdapter:
             "temperature": 0.7
         }
         
-        response = requests.post(self.endpoint, json=payload, headers=headers)
+        response = self._post(payload, headers)
         if response.status_code != 200:
             raise RuntimeError(f"Mistral API error: {response.text}")
             
@@ -327,7 +382,7 @@ class ModelAdapter:
             }
         }
         
-        response = requests.post(self.endpoint, json=payload, headers=headers)
+        response = self._post(payload, headers)
         if response.status_code != 200:
             raise RuntimeError(f"Ollama API error: {response.text}")
             
@@ -348,7 +403,7 @@ class ModelAdapter:
             }
         }
         
-        response = requests.post(self.endpoint, json=payload, headers=headers)
+        response = self._post(payload, headers)
         if response.status_code != 200:
             raise RuntimeError(f"Hugging Face API error: {response.text}")
             
@@ -68,6 +68,25 @@ except ImportError:
 # Get structured logger
 logger = get_logger("ai-pr-reviewer")
 
+# Top-level sections of the AI review
+_SUMMARY_PATTERN = re.compile(r'(?:^|\n)## Summary\s*\n(.*?)(?=\n##|\Z)', re.DOTALL)
+_OVERVIEW_PATTERN = re.compile(r'(?:^|\n)## Overview of Changes\s*\n(.*?)(?=\n##|\Z)', re.DOTALL)
+_RECOMMENDATIONS_PATTERN = re.compile(r'(?:^|\n)## Recommendations\s*\n(.*?)(?=\n##|\Z)', re.DOTALL)
+_DETAILED_FEEDBACK_PATTERN = re.compile(r'(?:^|\n)## Detailed Feedback\s*\n(.*?)(?=\n##|\Z)', re.DOTALL)
+_FILE_COMMENTS_PATTERN = re.compile(r'(?:^|\n)## File-Specific Comments\s*\n(.*?)(?=\n##|\Z)', re.DOTALL)
+
+# File-specific comments, e.g. "### src/app.py:42"
+_FILE_SECTION_PATTERN = re.compile(
+    r'(?:^|\n)### ([^\n:]+):(\d+)\s*\n(.*?)(?=\n### [^\n:]+:\d+|\Z)', re.DOTALL
+)
+
+# Lenient fallback for file-specific comments, e.g. "In src/app.py, line 42:"
+_ALT_FILE_SECTION_PATTERN = re.compile(
+    r'(?:^|\n)(?:In|File|At) ([^\n:,]+)[,:]? (?:line|at line) (\d+)[:]?\s*\n(.*?)'
+    r'(?=\n(?:In|File|At) [^\n:,]+[,:]? (?:line|at line) \d+[:]?|\Z)',
+    re.DOTALL
+)
+
 
 @with_context
 def load_config(config_path: str = "config.yaml") -> Dict[str, Any]:
@@ -86,7 +105,7 @@ def load_config(config_path: str = "config.yaml") -> Dict[str, Any]:
     """
     # Validate the config path
     if not os.path.exists(config_path):
-        logger.error(f"Config file not found: {config_path}", 
+        logger.error("Config file not found: %s", config_path, 
                     context={"config_path": config_path})
         raise MissingConfigurationError("config_file")
     
@@ -94,7 +113,7 @@ def load_config(config_path: str = "config.yaml") -> Dict[str, Any]:
         with open(config_path, "r") as f:
             config = yaml.safe_load(f) or {}
     except yaml.YAMLError as e:
-        logger.error(f"Failed to parse YAML in config file: {e}",
+        logger.error("Failed to parse YAML in config file: %s", e,
                     context={"config_path": config_path, "error": str(e)})
         raise InvalidConfigurationError("config_file", f"Invalid YAML format: {e}")
     
@@ -116,7 +135,7 @@ def load_config(config_path: str = "config.yaml") -> Dict[str, Any]:
                 logger.info("Successfully loaded cursor rules", 
                            context={"rules_count": len(rules)})
         except Exception as e:
-            logger.warning(f"Failed to load cursor rules: {e}",
+            logger.warning("Failed to load cursor rules: %s", e,
                          context={"error": str(e)})
     
     # Validate minimum required configuration
@@ -137,7 +156,7 @@ def load_config(config_path: str = "config.yaml") -> Dict[str, Any]:
     
     if missing_fields:
         missing_fields_str = ", ".join(missing_fields)
-        logger.error(f"Missing required fields in model config: {missing_fields_str}",
+        logger.error("Missing required fields in model config: %s", missing_fields_str,
                     context={"config_path": config_path, "missing_fields": missing_fields})
         raise MissingConfigurationError(f"model.{missing_fields[0]}" if missing_fields else "model")
     
@@ -358,7 +377,7 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
     try:
         # Load config
         config_file = config_path or "config.yaml"
-        logger.info(f"Loading configuration from {config_file}", 
+        logger.info("Loading configuration from %s", config_file, 
                    context={"config_path": config_file})
         config = load_config(config_file)
         
@@ -369,30 +388,32 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
         # Initialize model adapter
         provider = config['model']['provider']
         model_name = config['model']['model']
-        logger.info(f"Initializing AI model adapter", 
+        logger.info("Initializing AI model adapter", 
                    context={"provider": provider, "model": model_name})
         model_config = config.get("model", {})
         model_adapter = ModelAdapter(model_config)
     except VisionPRAIError as e:
-        logger.error(f"Configuration error: {e.message}",
+        logger.error("Configuration error: %s", e.message,
                    context={"error_code": e.error_code})
         return False
     except Exception as e:
-        logger.error(f"Initialization error: {str(e)}",
+        logger.error("Initialization error: %s", e,
                     context={"error_type": type(e).__name__},
                     exc_info=True)
         return False
     
+    # Fetch PR files first, so that rebuilding a diff GitHub cannot render
+    # doesn't fetch them a second time
+    logger.info("Fetching files for PR #%s in %s", pr_number, repo)
+    files = get_pr_files(repo, pr_number, github_token)
+    
     # Fetch PR diff
-    logger.info(f"Fetching diff for PR #{pr_number} in {repo}")
-    diff = get_pr_diff(repo, pr_number, github_token)
+    logger.info("Fetching diff for PR #%s in %s", pr_number, repo)
+    diff = get_pr_diff(repo, pr_number, github_token, files=files or None)
     if not diff:
         logger.error("No diff found. Exiting.")
         return False
     
-    # Fetch PR files
-    logger.info(f"Fetching files for PR #{pr_number} in {repo}")
-    files = get_pr_files(repo, pr_number, github_token)
     if not files:
         logger.warning("No files found. Continuing with diff only.")
         
@@ -406,7 +427,7 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
         if file_filter.enabled:
             filtered_count = original_file_count - len(files)
             if filtered_count > 0:
-                logger.info(f"Filtered out {filtered_count} files based on configured rules", 
+                logger.info("Filtered out %d files based on configured rules", filtered_count, 
                            context={"original_count": original_file_count, 
                                    "filtered_count": len(files)})
     
@@ -416,35 +437,31 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
     
     # Call AI for review
     try:
-        logger.info(f"Sending PR to {model_config['provider']} {model_config['model']} for review")
+        logger.info("Sending PR to %s %s for review", model_config['provider'], model_config['model'])
         review_text = model_adapter.generate_response(prompt)
         
         # Log the first part of the response for debugging
-        logger.debug(f"AI response first 500 chars: {review_text[:500]}")
+        logger.debug("AI response first 500 chars: %s", review_text[:500])
         
         # Verify that we received a non-empty response
         if not review_text or len(review_text.strip()) < 10:
             logger.error("Received empty or very short response from AI model")
             return False
     except Exception as e:
-        logger.error(f"Error generating review: {str(e)}")
+        logger.error("Error generating review: %s", e)
         return False
     
     # Post summary overview as general comment
     logger.info("Posting overview comment")
     
     # Extract just summary and overview sections
-    summary_pattern = r'(?:^|\n)## Summary\s*\n(.*?)(?=\n##|\Z)'
-    overview_pattern = r'(?:^|\n)## Overview of Changes\s*\n(.*?)(?=\n##|\Z)'
-    recommendations_pattern = r'(?:^|\n)## Recommendations\s*\n(.*?)(?=\n##|\Z)'
-    
-    summary_match = re.search(summary_pattern, review_text, re.DOTALL)
-    overview_match = re.search(overview_pattern, review_text, re.DOTALL)
-    recommendations_match = re.search(recommendations_pattern, review_text, re.DOTALL)
+    summary_match = _SUMMARY_PATTERN.search(review_text)
+    overview_match = _OVERVIEW_PATTERN.search(review_text)
+    recommendations_match = _RECOMMENDATIONS_PATTERN.search(review_text)
     
     # Log the review text for debugging
-    logger.debug(f"Review text received (first 1000 chars): {review_text[:1000]}...")
-    logger.debug(f"Review text received (last 1000 chars): {review_text[-1000:]}...")
+    logger.debug("Review text received (first 1000 chars): %s...", review_text[:1000])
+    logger.debug("Review text received (last 1000 chars): %s...", review_text[-1000:])
     
     overview_text = "# AI Review Summary\n\n"
     
@@ -486,7 +503,7 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
         else:
             logger.info("Successfully posted overview comment")
     except Exception as e:
-        logger.error(f"Exception while posting overview comment: {str(e)}", exc_info=True)
+        logger.error("Exception while posting overview comment: %s", e, exc_info=True)
         # Continue anyway to try posting line comments
     
     # Check if we should post line-specific comments
@@ -499,17 +516,23 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
             # Parse the diff to get file/line mapping
             file_line_map = parse_diff_for_lines(diff)
             
+            # Index the diff position of each line once, instead of scanning
+            # a file's lines for every comment on it
+            line_positions = {
+                path: {line_num: pos for line_num, pos, _ in reversed(lines)}
+                for path, lines in file_line_map.items()
+            }
+            
             # First use the standard extractor for explicitly marked line comments
             comment_extractor = CommentExtractor(config_path=config_path or "config.yaml")
             standard_line_comments = comment_extractor.extract_line_comments(review_text, file_line_map)
-            logger.debug(f"Extracted {len(standard_line_comments)} standard line comments")
+            logger.debug("Extracted %d standard line comments", len(standard_line_comments))
             
             # Now extract file-specific sections and convert them to line comments for each file
             file_sections = {}
             
             # Look for comments in both the main review and the Detailed Feedback section
-            detailed_feedback_pattern = r'(?:^|\n)## Detailed Feedback\s*\n(.*?)(?=\n##|\Z)'
-            detailed_feedback_match = re.search(detailed_feedback_pattern, review_text, re.DOTALL)
+            detailed_feedback_match = _DETAILED_FEEDBACK_PATTERN.search(review_text)
             
             # If we found a Detailed Feedback section, extract comments from there
             detailed_feedback_text = ""
@@ -522,8 +545,7 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
                 logger.warning("No Detailed Feedback section found, using entire review text")
                 
             # Also check for a File-Specific Comments section
-            file_comments_pattern = r'(?:^|\n)## File-Specific Comments\s*\n(.*?)(?=\n##|\Z)'
-            file_comments_match = re.search(file_comments_pattern, review_text, re.DOTALL)
+            file_comments_match = _FILE_COMMENTS_PATTERN.search(review_text)
             
             if file_comments_match:
                 file_comments_text = file_comments_match.group(1).strip()
@@ -532,53 +554,44 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
                 detailed_feedback_text += "\n\n" + file_comments_text
             
             # Extract file-specific comments
-            file_section_pattern = r'(?:^|\n)### ([^\n:]+):(\d+)\s*\n(.*?)(?=\n### [^\n:]+:\d+|\Z)'
-            
-            file_section_matches = list(re.finditer(file_section_pattern, detailed_feedback_text, re.DOTALL))
-            logger.debug(f"Found {len(file_section_matches)} file section matches")
+            file_section_matches = list(_FILE_SECTION_PATTERN.finditer(detailed_feedback_text))
+            logger.debug("Found %d file section matches", len(file_section_matches))
             
             # Log the detailed feedback text for debugging
-            logger.debug(f"Detailed feedback text (first 1000 chars): {detailed_feedback_text[:1000]}")
+            logger.debug("Detailed feedback text (first 1000 chars): %s", detailed_feedback_text[:1000])
             
             # If no file section matches were found, try a more lenient pattern
             if not file_section_matches:
                 logger.warning("No file section matches found with primary pattern, trying alternative pattern")
-                alt_file_section_pattern = r'(?:^|\n)(?:In|File|At) ([^\n:,]+)[,:]? (?:line|at line) (\d+)[:]?\s*\n(.*?)(?=\n(?:In|File|At) [^\n:,]+[,:]? (?:line|at line) \d+[:]?|\Z)'
-                file_section_matches = list(re.finditer(alt_file_section_pattern, detailed_feedback_text, re.DOTALL))
-                logger.debug(f"Found {len(file_section_matches)} file section matches with alternative pattern")
+                file_section_matches = list(_ALT_FILE_SECTION_PATTERN.finditer(detailed_feedback_text))
+                logger.debug("Found %d file section matches with alternative pattern", len(file_section_matches))
             
             for match in file_section_matches:
                 filename = match.group(1).strip()
                 line_number = int(match.group(2))
                 content = match.group(3).strip()
                 
-                logger.debug(f"Processing file section match: {filename}:{line_number}")
-                logger.debug(f"Content preview: {content[:100]}...")
+                logger.debug("Processing file section match: %s:%s", filename, line_number)
+                logger.debug("Content preview: %s...", content[:100])
                 
                 if filename in file_line_map:
                     # Find the matching position for this line number
-                    matching_lines = [
-                        (line_num, pos, line_content) 
-                        for line_num, pos, line_content in file_line_map[filename] 
-                        if line_num == line_number
-                    ]
-                    if matching_lines:
-                        # Use the first matching position
-                        _, position, _ = matching_lines[0]
+                    position = line_positions[filename].get(line_number)
+                    if position is not None:
                         file_sections[f"{filename}:{line_number}"] = {
                             "path": filename,
                             "line": line_number,
                             "position": position,  # Store position separately from line number
                             "body": content
                         }
-                        logger.debug(f"Added file section for {filename}:{line_number} at position {position}")
+                        logger.debug("Added file section for %s:%s at position %s", filename, line_number, position)
                     else:
-                        logger.warning(f"No matching position found for {filename}:{line_number}")
+                        logger.warning("No matching position found for %s:%s", filename, line_number)
                         # Try to find the closest line number as a fallback
                         if file_line_map[filename]:
                             closest_line = min(file_line_map[filename], key=lambda x: abs(x[0] - line_number))
                             closest_line_num, closest_pos, _ = closest_line
-                            logger.info(f"Using closest line {closest_line_num} at position {closest_pos} as fallback")
+                            logger.info("Using closest line %s at position %s as fallback", closest_line_num, closest_pos)
                             file_sections[f"{filename}:{closest_line_num}"] = {
                                 "path": filename,
                                 "line": closest_line_num,
@@ -586,12 +599,12 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
                                 "body": f"[Originally for line {line_number}] {content}"
                             }
                 else:
-                    logger.warning(f"File {filename} not found in file_line_map")
+                    logger.warning("File %s not found in file_line_map", filename)
                     # Try to find a similar filename as a fallback
                     similar_files = [f for f in file_line_map.keys() if filename in f or f in filename]
                     if similar_files:
                         similar_file = similar_files[0]
-                        logger.info(f"Using similar file {similar_file} as fallback")
+                        logger.info("Using similar file %s as fallback", similar_file)
                         # Use the first line of the similar file
                         if file_line_map[similar_file]:
                             first_line = file_line_map[similar_file][0]
@@ -605,28 +618,28 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
             
             # Convert file sections to line comments 
             additional_comments = list(file_sections.values())
-            logger.debug(f"Added {len(additional_comments)} additional comments from file sections")
+            logger.debug("Added %d additional comments from file sections", len(additional_comments))
             
             # Combine standard and file-section comments
             all_comments = standard_line_comments + additional_comments
             
             # Post line comments if any were found
             if all_comments:
-                logger.info(f"Posting {len(all_comments)} line-specific comments",
+                logger.info("Posting %d line-specific comments", len(all_comments),
                            context={"comments_count": len(all_comments)})
                 try:
                     # Ensure all comments have the required fields for the GitHub API
                     for comment in all_comments:
                         # GitHub requires these fields: path, body, line, side
                         if "path" not in comment or "body" not in comment:
-                            logger.error(f"Comment missing required fields: {comment}")
+                            logger.error("Comment missing required fields: %s", comment)
                             continue
                             
                         # Ensure line is an integer
                         if "line" in comment:
                             comment["line"] = int(comment["line"])
                         else:
-                            logger.warning(f"Comment missing line number for {comment.get('path', 'unknown file')}")
+                            logger.warning("Comment missing line number for %s", comment.get('path', 'unknown file'))
                             comment["line"] = 1  # Default to line 1 if no line specified
                         
                         # Ensure side is always RIGHT (for new version)
@@ -641,18 +654,35 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
                     valid_comments = [c for c in all_comments if "path" in c and "body" in c and "line" in c and "side" in c]
                     
                     if len(valid_comments) < len(all_comments):
-                        logger.warning(f"Filtered out {len(all_comments) - len(valid_comments)} invalid comments")
+                        logger.warning("Filtered out %d invalid comments", len(all_comments) - len(valid_comments))
+                    
+                    # GitHub rejects comments on lines outside the diff with a 422,
+                    # so drop them here instead of spending requests on them
+                    commentable_comments = []
+                    for c in valid_comments:
+                        positions = line_positions.get(c["path"], {})
+                        line = int(c["line"])
+                        start_line = int(c.get("start_line", line))
+                        if line in positions and start_line in positions:
+                            commentable_comments.append(c)
+                        else:
+                            logger.debug("Dropping comment on %s:%s-%s outside the diff",
+                                         c["path"], start_line, line)
+                    if len(commentable_comments) < len(valid_comments):
+                        logger.warning("Dropped %d comments on lines outside the diff",
+                                       len(valid_comments) - len(commentable_comments))
+                    valid_comments = commentable_comments
                     
                     # Log sample comments for debugging
                     if valid_comments:
                         sample = valid_comments[0]
-                        logger.debug(f"Sample comment: path={sample['path']}, line={sample['line']}, side={sample['side']}")
+                        logger.debug("Sample comment: path=%s, line=%s, side=%s", sample['path'], sample['line'], sample['side'])
                         
                         # Log number of comments per file
                         file_counts = {}
                         for c in valid_comments:
                             file_counts[c["path"]] = file_counts.get(c["path"], 0) + 1
-                        logger.debug(f"Comments by file: {file_counts}")
+                        logger.debug("Comments by file: %s", file_counts)
                     
                     # Post the comments
                     if valid_comments:
@@ -663,17 +693,17 @@ def review_pr(config_path: Optional[str] = None, verbose: bool = False) -> bool:
                     else:
                         logger.warning("No valid comments to post")
                 except Exception as e:
-                    logger.error(f"Exception while posting line comments: {str(e)}", exc_info=True)
+                    logger.error("Exception while posting line comments: %s", e, exc_info=True)
             else:
                 logger.info("No line-specific comments found in the review",
                            context={"repo": repo, "pr_number": pr_number})
         except CommentExtractionError as e:
-            logger.error(f"Error extracting line comments: {str(e)}",
+            logger.error("Error extracting line comments: %s", e,
                         context={"error_code": e.error_code, "repo": repo, "pr_number": pr_number},
                         exc_info=True)
             # Continue despite errors in line comments
         except Exception as e:
-            logger.error(f"Error processing line comments: {str(e)}",
+            logger.error("Error processing line comments: %s", e,
                         context={"repo": repo, "pr_number": pr_number},
                         exc_info=True)
             # Continue despite errors in line comments
@@ -8,9 +8,25 @@ import re
 import logging
 import json
 import time
-from typing import Dict, List, Optional, Tuple, Any, Union
+import random
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple, Any, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:  # urllib3 1.26, still allowed by requests, has no BaseHTTPResponse
+    from urllib3.response import BaseHTTPResponse
+
+try:
+    import orjson
+    _HAVE_ORJSON = True
+except ImportError:  # orjson is optional; fall back to the stdlib json module
+    _HAVE_ORJSON = False
 
 # Configure logging
 logging.basicConfig(
@@ -19,48 +35,644 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ai-pr-reviewer")
 
+# Default headers for GitHub REST API requests
+_JSON_HEADERS = {"Accept": "application/vnd.github.v3+json"}
+_DIFF_HEADERS = {"Accept": "application/vnd.github.v3.diff"}
+
+# (connect, read) timeout in seconds for GitHub API requests
+_TIMEOUT = (5, 30)
+
+# Responses of conditional GETs are cached here together with their ETag,
+# so that reruns for an unchanged pull request get a 304 without a body
+_CACHE_DIR = Path(os.environ.get("PRREVIEWER_CACHE", tempfile.gettempdir())) / "aiprr_cache"
+
+# Cache files untouched for this many seconds are deleted, see _prune_cache
+_CACHE_MAX_AGE = 7 * 24 * 3600
+_CACHE_PRUNED = threading.Event()
+
+# In-process copy of the cache, keyed by (repo, pr_number, kind)
+_ETAG_CACHE: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+_ETAG_CACHE_LOCK = threading.Lock()
+
+# Diff fetches in progress, keyed by (repo, pr_number, token), so concurrent
+# callers share one request
+_INFLIGHT_DIFFS: Dict[Tuple[str, str, str], "Future[Optional[str]]"] = {}
+_INFLIGHT_DIFFS_LOCK = threading.Lock()
+
+
+class _GitHubRetry(Retry):
+    """
+    Retry policy for GitHub API requests.
+    
+    Idempotent requests are retried on rate limiting and server errors. POSTs
+    are only retried when GitHub rate limited them (HTTP 429, or a secondary
+    rate limit reported as HTTP 403 with Retry-After), where the request was
+    not processed, so a retry can never post a comment twice. A Retry-After
+    header from GitHub takes precedence over the backoff, which is capped at
+    ``MAX_BACKOFF`` seconds. Both are jittered so that concurrent posts do not
+    retry in lockstep.
+    """
+    
+    # GitHub reports secondary rate limits as 403 with a Retry-After header
+    RETRY_AFTER_STATUS_CODES = frozenset({403, 413, 429, 503})
+    MAX_BACKOFF = 60
+    
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method == "POST":
+            throttled = status_code == 429 or (status_code == 403 and has_retry_after)
+            return throttled and bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+    
+    def get_backoff_time(self) -> float:
+        backoff = min(super().get_backoff_time(), self.MAX_BACKOFF)
+        return backoff + random.uniform(0, self.backoff_factor) if backoff else backoff
+    
+    def get_retry_after(self, response: "BaseHTTPResponse") -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        return retry_after + random.uniform(0, 1) if retry_after is not None else None
+
+
+class _RateLimitGuard:
+    """
+    Thread-safe tracker of the GitHub rate limit, fed from response headers.
+    
+    Every GitHub response reports the remaining request budget and when it
+    resets. The shared session checks it before every request, so callers
+    pause until the reset instead of running into 403/429 responses.
+    """
+    
+    # Longest pause, in seconds, used to spread out requests while the
+    # budget is low but not yet exhausted
+    MAX_PACING_DELAY = 10.0
+    
+    def __init__(self) -> None:
+        """Initialize the guard with an unknown budget."""
+        self._remaining: Optional[int] = None
+        self._reset_ts = 0.0
+        self._lock = threading.Lock()
+    
+    def update(self, response: requests.Response, *args: Any, **kwargs: Any) -> None:
+        """
+        Record the rate limit reported by a response.
+        
+        Registered as a ``response`` hook on the shared session.
+        
+        Args:
+            response: The HTTP response
+        """
+        headers = response.headers
+        try:
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset = headers.get("X-RateLimit-Reset")
+            retry_after = headers.get("Retry-After")
+            
+            with self._lock:
+                if remaining is not None:
+                    self._remaining = int(remaining)
+                if reset is not None:
+                    self._reset_ts = float(reset)
+                if retry_after is not None:
+                    self._remaining = 0
+                    self._reset_ts = time.time() + float(retry_after)
+        except ValueError:
+            logger.debug("Ignoring malformed rate limit headers")
+    
+    def wait_if_low(self, pace: bool = True, threshold: int = 2, pace_below: int = 50) -> None:
+        """
+        Wait when the remaining rate limit budget runs low.
+        
+        With ``threshold`` (2) or fewer requests left, every call waits for
+        the reset. Below ``pace_below`` (50) remaining requests, calls with
+        ``pace`` set also wait for an even share of the time left until the
+        reset, at most ``MAX_PACING_DELAY`` seconds, so that the budget lasts
+        until then. Reads pass ``pace=False``: they are cheap, often answered
+        from the ETag cache, and pacing them would slow down a whole review.
+        
+        Args:
+            pace: Whether to spread this request out while the budget is low
+            threshold: Wait for the reset when at most this many requests remain
+            pace_below: Start spreading requests out below this many remaining
+        """
+        with self._lock:
+            remaining = self._remaining
+            if remaining is None or remaining >= pace_below:
+                return
+            wait = self._reset_ts - time.time()
+        
+        if wait <= 0:
+            return
+        if remaining <= threshold:
+            logger.warning("GitHub rate limit nearly exhausted, waiting %.0f seconds", wait)
+            time.sleep(wait)
+        elif pace:
+            time.sleep(min(wait / remaining, self.MAX_PACING_DELAY))
+
+
+_RATE_LIMIT_GUARD = _RateLimitGuard()
+
+
+class _RateLimiter:
+    """
+    Thread-safe limiter that spaces out calls to at most ``rate`` per second.
+    
+    The rate adapts to GitHub's responses (additive increase, multiplicative
+    decrease): it is halved whenever a request is throttled and recovers in
+    small steps after each successful one, up to the initial rate.
+    """
+    
+    def __init__(self, rate: float, min_rate: float = 0.5, increase: float = 0.25):
+        """
+        Initialize the rate limiter.
+        
+        Args:
+            rate: Maximum number of calls per second
+            min_rate: Lower bound for the rate after throttling
+            increase: Calls per second added back after each successful call
+        """
+        self._max_rate = rate
+        self._min_rate = min(min_rate, rate)
+        self._increase = increase
+        self._rate = rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        """Block until the caller may proceed without exceeding the rate."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + 1.0 / self._rate
+        
+        if wait > 0:
+            time.sleep(wait)
+    
+    def record(self, throttled: bool) -> None:
+        """
+        Adjust the rate to the outcome of a call.
+        
+        Args:
+            throttled: Whether GitHub rate limited the call
+        """
+        with self._lock:
+            if throttled:
+                self._rate = max(self._min_rate, self._rate / 2)
+            else:
+                self._rate = min(self._max_rate, self._rate + self._increase)
+
+
+# Posting comments is capped at a few requests per second, per GitHub's
+# guidance for avoiding secondary rate limits
+_MAX_CONCURRENT_POSTS = 3
+_COMMENT_RATE_LIMITER = _RateLimiter(rate=3)
+
+
+def _record_post_outcome(response: requests.Response, *args: Any, **kwargs: Any) -> None:
+    """
+    Feed the outcome of a POST to GitHub back into the comment rate limiter.
+    
+    Registered as a ``response`` hook on the shared session. Requests that
+    were throttled and then retried by the adapter count as throttled too.
+    
+    Args:
+        response: The HTTP response
+    """
+    if response.request.method != "POST":
+        return
+    
+    retries = getattr(response.raw, "retries", None)
+    history = getattr(retries, "history", None) or ()
+    throttled = (
+        response.status_code == 429
+        or (response.status_code == 403 and "Retry-After" in response.headers)
+        or any(entry.status in (403, 429) for entry in history)
+    )
+    _COMMENT_RATE_LIMITER.record(throttled)
+
+
+class _GitHubSession(requests.Session):
+    """Session that waits out a nearly exhausted rate limit before each request."""
+    
+    def request(self, method: Union[str, bytes], url: Union[str, bytes],
+                *args: Any, **kwargs: Any) -> requests.Response:
+        """Send a request once the rate limit allows it, see ``_RateLimitGuard``."""
+        if isinstance(method, bytes):
+            method = method.decode("ascii")
+        _RATE_LIMIT_GUARD.wait_if_low(
+            pace=method.upper() not in ("GET", "HEAD", "OPTIONS")
+        )
+        return super().request(method, url, *args, **kwargs)
+
+
+def _create_session() -> requests.Session:
+    """
+    Create the HTTP session shared by all GitHub API calls.
+    
+    Reusing one session keeps connections to api.github.com alive between
+    calls, so only the first request pays for the TCP and TLS handshake.
+    Throttled and failed requests are retried transparently, see
+    ``_GitHubRetry``, and every request is paced by ``_RATE_LIMIT_GUARD``.
+    
+    Returns:
+        A configured requests session
+    """
+    session = _GitHubSession()
+    retry = _GitHubRetry(
+        total=8,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(_RATE_LIMIT_GUARD.update)
+    session.hooks["response"].append(_record_post_outcome)
+    return session
+
+
+_SESSION = _create_session()
+
+
+def get_session() -> requests.Session:
+    """
+    Get the HTTP session shared by all GitHub API calls.
+    
+    All requests to GitHub go through this function, so tests can patch it
+    to inject a mock session.
+    
+    Returns:
+        The shared requests session
+    """
+    return _SESSION
+
+
+def _json_dumps(payload: Any) -> bytes:
+    """
+    Serialize a payload to a UTF-8 JSON body.
+    
+    orjson is used when it is installed; it is considerably faster than the
+    stdlib encoder on large review bodies and model prompts.
+    
+    Args:
+        payload: JSON-serializable payload
+        
+    Returns:
+        The encoded body
+    """
+    if _HAVE_ORJSON:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    """
+    Parse a JSON body, with orjson when it is installed.
+    
+    Args:
+        data: The raw body
+        
+    Returns:
+        The decoded JSON value
+        
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    if _HAVE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _post_json(url: str, headers: Dict[str, str], payload: Any) -> requests.Response:
+    """
+    POST a JSON payload with the shared session.
+    
+    Args:
+        url: The URL to post to
+        headers: Request headers
+        payload: JSON-serializable payload
+        
+    Returns:
+        The HTTP response
+    """
+    return get_session().post(
+        url,
+        headers={**headers, "Content-Type": "application/json"},
+        data=_json_dumps(payload),
+        timeout=_TIMEOUT
+    )
+
+
+def _json(response: requests.Response) -> Any:
+    """
+    Decode a JSON response body.
+    
+    Bodies that cannot be parsed go through ``response.json()``, so callers
+    see the usual requests exceptions.
+    
+    Args:
+        response: The HTTP response
+        
+    Returns:
+        The decoded JSON value
+    """
+    try:
+        return _json_loads(response.content)
+    except ValueError:
+        return response.json()
+
+
+# GitHub rejects comment bodies longer than 65536 characters
+_MAX_COMMENT_LENGTH = 65000
+_TRUNCATION_NOTICE = "\n\n*(Comment truncated due to length)*"
+
+# Resource names of a pull request's cache files, see ``_cache_path``
+_CACHE_KIND_RE = re.compile(r'(?:diff|head|files-\d+)\.json')
+
+# Fields accepted by GitHub for each comment of a pull request review
+_REVIEW_COMMENT_FIELDS = frozenset({"path", "body", "line", "side", "start_line", "start_side"})
+
+# Diff header lines, either the new file path ("+++ b/<path>", group 1) or
+# a hunk header ("@@ -a,b +c,d @@", group 2)
+_DIFF_HEADER_RE = re.compile(r'\+\+\+ b/(.*)|@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+
+def _cache_path(repo: str, pr_number: str, kind: str) -> Path:
+    """
+    Get the cache file for a pull request resource.
+    
+    Args:
+        repo: Repository in the format 'owner/repo'
+        pr_number: Pull request number
+        kind: The cached resource, e.g. 'diff' or 'files'
+        
+    Returns:
+        Path of the cache file
+    """
+    return _CACHE_DIR / f"{repo.replace('/', '__')}-{pr_number}-{kind}.json"
+
+
+def _load_cached(repo: str, pr_number: str, kind: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a cached response, from memory if this process fetched it already.
+    
+    Args:
+        repo: Repository in the format 'owner/repo'
+        pr_number: Pull request number
+        kind: The cached resource, e.g. 'diff' or 'files'
+        
+    Returns:
+        Dictionary with the 'etag' and 'body' of the response, or None if
+        nothing usable is cached
+    """
+    key = (repo, str(pr_number), kind)
+    with _ETAG_CACHE_LOCK:
+        cached = _ETAG_CACHE.get(key)
+    if cached is not None:
+        return cached
+    
+    try:
+        with open(_cache_path(repo, pr_number, kind), "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if not isinstance(cached, dict) or "etag" not in cached or "body" not in cached:
+        return None
+    
+    with _ETAG_CACHE_LOCK:
+        _ETAG_CACHE[key] = cached
+    return cached
+
+
+def _store_cached(repo: str, pr_number: str, kind: str, etag: Optional[str], body: Any) -> None:
+    """
+    Cache a response body under its ETag, in memory and on disk.
+    
+    The file is written to a temporary name and renamed into place, so
+    concurrent runs never read a partially written entry. Failing to write
+    the cache file is not an error. The first write of a process also
+    deletes expired cache files, see ``_prune_cache``.
+    
+    Args:
+        repo: Repository in the format 'owner/repo'
+        pr_number: Pull request number
+        kind: The cached resource, e.g. 'diff' or 'files'
+        etag: ETag header of the response; without one any cached entry
+            is dropped from memory
+        body: JSON-serializable response body
+    """
+    key = (repo, str(pr_number), kind)
+    if not etag:
+        with _ETAG_CACHE_LOCK:
+            _ETAG_CACHE.pop(key, None)
+        return
+    
+    cached = {"etag": etag, "body": body}
+    with _ETAG_CACHE_LOCK:
+        _ETAG_CACHE[key] = cached
+    
+    if not _CACHE_PRUNED.is_set():
+        _CACHE_PRUNED.set()
+        _prune_cache()
+    
+    path = _cache_path(repo, pr_number, kind)
+    try:
+        # Diffs of private repositories end up here, keep them to the owner
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=path.parent, delete=False, suffix=".tmp"
+        ) as f:
+            json.dump(cached, f)
+        os.replace(f.name, path)
+    except OSError as e:
+        logger.debug("Could not write cache file %s: %s", path, e)
+
+
+def _prune_cache(max_age: float = _CACHE_MAX_AGE) -> None:
+    """
+    Delete cache files that have not been written for ``max_age`` seconds.
+    
+    Args:
+        max_age: Maximum age of a cache file in seconds
+    """
+    cutoff = time.time() - max_age
+    for path in _CACHE_DIR.glob("*.json"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError as e:
+            logger.debug("Could not remove cache file %s: %s", path, e)
+
+
+def clear_cache() -> None:
+    """
+    Drop every cached response held in memory.
+    
+    Long-running callers, e.g. a webhook server reviewing many pull
+    requests, can call this to bound memory use. Entries on disk are kept,
+    so later fetches still revalidate them; expired cache files are removed
+    by _prune_cache().
+    """
+    with _ETAG_CACHE_LOCK:
+        _ETAG_CACHE.clear()
 
-def get_pr_diff(repo: str, pr_number: str, token: str) -> Optional[str]:
+
+def invalidate_pr_cache(repo: str, pr_number: str) -> None:
+    """
+    Drop every cached response of a pull request, in memory and on disk.
+    
+    Call this when the pull request is known to have changed, e.g. from a
+    webhook handler, so the next fetch downloads it unconditionally instead
+    of revalidating a stale entry.
+    
+    Args:
+        repo: Repository in the format 'owner/repo'
+        pr_number: Pull request number
+    """
+    with _ETAG_CACHE_LOCK:
+        for key in [k for k in _ETAG_CACHE if k[:2] == (repo, str(pr_number))]:
+            del _ETAG_CACHE[key]
+    
+    # Match the resource names exactly, so that e.g. PR 1 of "o/r" does not
+    # also match "o__r-1-5-diff.json", the diff of PR 5 of "o/r-1"
+    prefix = f"{repo.replace('/', '__')}-{pr_number}-"
+    for path in _CACHE_DIR.glob(f"{prefix}*.json"):
+        if not _CACHE_KIND_RE.fullmatch(path.name[len(prefix):]):
+            continue
+        try:
+            path.unlink()
+        except OSError as e:
+            logger.debug("Could not remove cache file %s: %s", path, e)
+
+
+def get_pr_diff(repo: str, pr_number: str, token: str,
+                files: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
     """
     Fetch the diff for a pull request.
     
+    The unified diff is streamed from the pull request endpoint into a single
+    buffer that is decoded once. If GitHub cannot render the diff (HTTP 406,
+    e.g. because it is too large), it is rebuilt from the per-file patches.
+    A previously fetched diff is revalidated with its ETag and reused when
+    GitHub reports it unchanged. Concurrent calls for the same pull request
+    wait for the first one's request instead of sending their own.
+    
     Args:
         repo: Repository in the format 'owner/repo'
         pr_number: Pull request number
         token: GitHub token
+        files: Changed files as returned by ``get_pr_files``, if the caller
+            already has them; saves fetching them again for the rebuild
         
     Returns:
         The diff as a string, or None if the request failed
     """
-    headers = {
-        "Accept": "application/vnd.github.v3.diff",
-        "Authorization": f"Bearer {token}"
-    }
-    url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/files"
+    key = (repo, str(pr_number), token)
+    with _INFLIGHT_DIFFS_LOCK:
+        pending = _INFLIGHT_DIFFS.get(key)
+        if pending is None:
+            future: "Future[Optional[str]]" = Future()
+            _INFLIGHT_DIFFS[key] = future
+    if pending is not None:
+        return pending.result()
     
     try:
-        logger.info(f"Fetching diff for PR #{pr_number} in {repo}")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        
-        # Extract patch content from each file
-        files = response.json()
-        diff_content = []
+        diff = _fetch_pr_diff(repo, pr_number, token, files)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(diff)
+        return diff
+    finally:
+        with _INFLIGHT_DIFFS_LOCK:
+            del _INFLIGHT_DIFFS[key]
+
+
+def _fetch_pr_diff(repo: str, pr_number: str, token: str,
+                   files: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+    """
+    Fetch the diff for a pull request, see ``get_pr_diff``.
+    
+    Args:
+        repo: Repository in the format 'owner/repo'
+        pr_number: Pull request number
+        token: GitHub token
+        files: Changed files as returned by ``get_pr_files``, if known
         
-        for file in files:
-            if 'patch' in file:
-                diff_content.append(f"diff --git a/{file['filename']} b/{file['filename']}\n{file['patch']}")
+    Returns:
+        The diff as a string, or None if the request failed
+    """
+    headers = {**_DIFF_HEADERS, "Authorization": f"Bearer {token}"}
+    url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}"
+    cached = _load_cached(repo, pr_number, "diff")
+    if cached:
+        headers["If-None-Match"] = cached["etag"]
+    
+    try:
+        logger.info("Fetching diff for PR #%s in %s", pr_number, repo)
+        with get_session().get(url, headers=headers, stream=True, timeout=_TIMEOUT) as response:
+            if response.status_code == 304 and cached:
+                logger.info("Diff for PR #%s is unchanged, using cached copy", pr_number)
+                return cached["body"] or None
+            if response.status_code == 406:
+                logger.warning("GitHub could not render the diff, rebuilding it from the changed files")
+                return _get_pr_diff_from_files(repo, pr_number, token, files)
+            response.raise_for_status()
+            
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                buffer.extend(chunk)
+            etag = response.headers.get("ETag")
         
-        return '\n'.join(diff_content) if diff_content else None
+        diff = buffer.decode("utf-8", errors="replace")
+        _store_cached(repo, pr_number, "diff", etag, diff)
+        return diff or None
     except requests.RequestException as e:
-        logger.error(f"Failed to fetch PR diff: {e}")
+        logger.error("Failed to fetch PR diff: %s", e)
         return None
 
 
+def _get_pr_diff_from_files(repo: str, pr_number: str, token: str,
+                            files: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+    """
+    Rebuild a unified diff for a pull request from its per-file patches.
+    
+    Args:
+        repo: Repository in the format 'owner/repo'
+        pr_number: Pull request number
+        token: GitHub token
+        files: Changed files as returned by ``get_pr_files``; fetched if not given
+        
+    Returns:
+        The diff as a string, or None if no file has a patch
+    """
+    diff_content = []
+    
+    if files is None:
+        files = get_pr_files(repo, pr_number, token)
+    
+    for file in files:
+        if 'patch' in file:
+            filename = file['filename']
+            diff_content.append(
+                f"diff --git a/{filename} b/{filename}\n"
+                f"--- a/{filename}\n"
+                f"+++ b/{filename}\n"
+                f"{file['patch']}"
+            )
+    
+    return '\n'.join(diff_content) if diff_content else None
+
+
 def get_pr_files(repo: str, pr_number: str, token: str) -> List[Dict[str, Any]]:
     """
     Fetch the list of files changed in a pull request.
     
+    Files are fetched 100 per page, following GitHub's ``Link`` header until
+    the last page. Each page previously fetched is revalidated with its ETag
+    and reused when GitHub reports it unchanged.
+    
     Args:
         repo: Repository in the format 'owner/repo'
         pr_number: Pull request number
@@ -69,19 +681,37 @@ def get_pr_files(repo: str, pr_number: str, token: str) -> List[Dict[str, Any]]:
     Returns:
         List of file information dictionaries
     """
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-        "Authorization": f"Bearer {token}"
-    }
-    url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/files"
+    headers = {**_JSON_HEADERS, "Authorization": f"Bearer {token}"}
+    url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/files?per_page=100"
+    files = []
+    page = 1
     
     try:
-        logger.info(f"Fetching files for PR #{pr_number} in {repo}")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        logger.info("Fetching files for PR #%s in %s", pr_number, repo)
+        while url:
+            kind = f"files-{page}"
+            cached = _load_cached(repo, pr_number, kind)
+            page_headers = {**headers, "If-None-Match": cached["etag"]} if cached else headers
+            
+            response = get_session().get(url, headers=page_headers, timeout=_TIMEOUT)
+            if response.status_code == 304 and cached:
+                logger.debug("Files page %d for PR #%s is unchanged, using cached copy", page, pr_number)
+                body = cached["body"]
+            else:
+                response.raise_for_status()
+                body = {
+                    "files": _json(response),
+                    "next": response.links.get("next", {}).get("url")
+                }
+                _store_cached(repo, pr_number, kind, response.headers.get("ETag"), body)
+            
+            files.extend(body["files"])
+            url = body["next"]
+            page += 1
+        
+        return files
     except requests.RequestException as e:
-        logger.error(f"Failed to fetch PR files: {e}")
+        logger.error("Failed to fetch PR files: %s", e)
         return []
 
 
@@ -89,6 +719,9 @@ def post_review_comment(repo: str, pr_number: str, token: str, review_text: str)
     """
     Post a review comment on a pull request.
     
+    The whole review is posted in a single request. Text longer than GitHub
+    accepts for a comment body is truncated.
+    
     Args:
         repo: Repository in the format 'owner/repo'
         pr_number: Pull request number
@@ -98,24 +731,25 @@ def post_review_comment(repo: str, pr_number: str, token: str, review_text: str)
     Returns:
         True if successful, False otherwise
     """
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-        "Authorization": f"Bearer {token}"
-    }
+    headers = {**_JSON_HEADERS, "Authorization": f"Bearer {token}"}
     url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/reviews"
     
+    body = _truncate(review_text)
+    if body is not review_text:
+        logger.warning("Review comment was truncated due to length")
+    
     data = {
-        "body": review_text,
+        "body": body,
         "event": "COMMENT"
     }
     
     try:
-        logger.info(f"Posting review comment on PR #{pr_number} in {repo}")
-        response = requests.post(url, headers=headers, json=data)
+        logger.info("Posting review comment on PR #%s in %s", pr_number, repo)
+        response = _post_json(url, headers, data)
         response.raise_for_status()
         return True
     except requests.RequestException as e:
-        logger.error(f"Failed to post review comment: {e}")
+        logger.error("Failed to post review comment: %s", e)
         return False
 
 
@@ -134,8 +768,6 @@ def post_review_sections(repo: str, pr_number: str, token: str, review_text: str
     Returns:
         True if the comments were posted successfully, False otherwise
     """
-    import time
-    
     if not split_sections:
         return post_review_comment(repo, pr_number, token, review_text)
     
@@ -219,16 +851,16 @@ def post_review_sections(repo: str, pr_number: str, token: str, review_text: str
     def post_with_retry(content, description):
         # Only try once, don't retry automatically
         try:
-            logger.info(f"Posting {description}")
+            logger.info("Posting %s", description)
             
             # Check content length - GitHub has a hard limit around 65536 chars
             if len(content) > 65000:
                 content = content[:65000] + "\n\n*(Comment truncated due to length)*"
-                logger.warning(f"{description} was truncated due to length")
+                logger.warning("%s was truncated due to length", description)
             
             # Add a longer delay before posting the last comments to avoid rate limits
             if comment_count >= 4:  # Later comments are more likely to hit rate limits
-                logger.info(f"Adding extra delay before posting comment #{comment_count+1}")
+                logger.info("Adding extra delay before posting comment #%d", comment_count + 1)
                 time.sleep(2)
             
             success = post_review_comment(repo, pr_number, token, content)
@@ -236,7 +868,7 @@ def post_review_sections(repo: str, pr_number: str, token: str, review_text: str
             time.sleep(1)
             return success
         except Exception as e:
-            logger.error(f"Error posting {description}: {e}")
+            logger.error("Error posting %s: %s", description, e)
             return False
     
     # Limit the number of comments to post to avoid rate limits
@@ -304,7 +936,8 @@ def post_review_sections(repo: str, pr_number: str, token: str, review_text: str
     # Post grouped comments
     for group, sections in grouped_files.items():
         if comment_count >= max_comments - 1:
-            logger.warning(f"Skipping remaining {len(grouped_files) - comment_count + 1} file groups due to comment limit")
+            logger.warning("Skipping remaining %d file groups due to comment limit",
+                           len(grouped_files) - comment_count + 1)
             break
             
         group_text = f"## Feedback for {group}\n\n" + "\n\n".join(sections)
@@ -324,6 +957,89 @@ def post_review_sections(repo: str, pr_number: str, token: str, review_text: str
     return success
 
 
+def _truncate(text: str, limit: int = _MAX_COMMENT_LENGTH) -> str:
+    """
+    Truncate text to fit in a GitHub comment.
+    
+    Text within the limit is returned as-is, without copying.
+    
+    Args:
+        text: The text to truncate
+        limit: Maximum number of characters to keep
+        
+    Returns:
+        The original text, or its first ``limit`` characters followed by a
+        truncation notice
+    """
+    if len(text) <= limit:
+        return text
+    return text[:limit] + _TRUNCATION_NOTICE
+
+
+def _format_review_comment(comment: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a comment into the shape expected by the GitHub reviews API.
+    
+    Comments that already have exactly that shape are returned as-is
+    instead of being copied.
+    
+    Args:
+        comment: Comment dictionary with at least 'path' and 'body' keys
+        
+    Returns:
+        Comment dictionary with 'path', 'body', 'line', 'side' and, for
+        multi-line comments, 'start_line' and 'start_side' keys
+    """
+    if (
+        comment.keys() <= _REVIEW_COMMENT_FIELDS
+        and "side" in comment
+        and type(comment.get("line")) is int
+        and ("start_line" not in comment
+             or (type(comment["start_line"]) is int and "start_side" in comment))
+    ):
+        return comment
+    
+    formatted_comment = {
+        "path": comment["path"],
+        "body": comment["body"],
+        "line": int(comment.get("line", 1)),
+        "side": comment.get("side", "RIGHT")
+    }
+    
+    # For multi-line comments, add start_line and start_side
+    if "start_line" in comment:
+        formatted_comment["start_line"] = int(comment["start_line"])
+        formatted_comment["start_side"] = comment.get("start_side", "RIGHT")
+    
+    return formatted_comment
+
+
+def _dedupe_review_comments(comments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop repeated review comments, keeping the first of each.
+    
+    Comments are duplicates if they have the same path, lines and body.
+    
+    Args:
+        comments: Comments formatted by ``_format_review_comment``
+        
+    Returns:
+        The comments without duplicates, in their original order
+    """
+    seen = set()
+    unique_comments = []
+    
+    for comment in comments:
+        key = (comment["path"], comment["line"], comment.get("start_line"), comment["body"])
+        if key in seen:
+            logger.debug("Skipping duplicate comment for %s:%s", comment["path"], comment["line"])
+            continue
+        seen.add(key)
+        unique_comments.append(comment)
+    
+    return unique_comments
+
+
 def post_line_comments(
     repo: str, 
     pr_number: str, 
@@ -347,174 +1063,198 @@ def post_line_comments(
         return True
         
     headers = {
-        "Accept": "application/vnd.github.v3+json",
+        **_JSON_HEADERS,
         "Authorization": f"Bearer {token}",
         "X-GitHub-Api-Version": "2022-11-28"  # Use explicit API version
     }
+    pull_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}"
     
-    # Get the latest commit SHA for the PR - required for review comments
+    # Get the head commit SHA of the PR - required for review comments. The
+    # pull request itself reports it, unlike the paginated commit list whose
+    # first page doesn't include the latest commit on PRs with many commits.
     try:
-        commits_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/commits"
-        commits_response = requests.get(commits_url, headers=headers)
-        commits_response.raise_for_status()
-        commits = commits_response.json()
-        if not commits:
-            logger.error("No commits found for PR")
-            return False
-        latest_commit_sha = commits[-1]["sha"]
-        logger.debug(f"Using latest commit SHA: {latest_commit_sha}")
+        cached = _load_cached(repo, pr_number, "head")
+        pull_headers = {**headers, "If-None-Match": cached["etag"]} if cached else headers
+        pull_response = get_session().get(pull_url, headers=pull_headers, timeout=_TIMEOUT)
+        if pull_response.status_code == 304 and cached:
+            latest_commit_sha = cached["body"]
+        else:
+            pull_response.raise_for_status()
+            latest_commit_sha = _json(pull_response)["head"]["sha"]
+            _store_cached(repo, pr_number, "head", pull_response.headers.get("ETag"), latest_commit_sha)
+        logger.debug("Using latest commit SHA: %s", latest_commit_sha)
     except Exception as e:
-        logger.error(f"Failed to get latest commit SHA: {str(e)}")
+        logger.error("Failed to get latest commit SHA: %s", e)
         return False
     
     # Format comments for the API
-    formatted_comments = []
-    for comment in comments:
-        formatted_comment = {
-            "path": comment["path"],
-            "body": comment["body"],
-            "line": int(comment.get("line", 1)),
-            "side": comment.get("side", "RIGHT")
-        }
-        
-        # For multi-line comments, add start_line and start_side
-        if "start_line" in comment:
-            formatted_comment["start_line"] = int(comment["start_line"])
-            formatted_comment["start_side"] = comment.get("start_side", "RIGHT")
-        
-        formatted_comments.append(formatted_comment)
+    formatted_comments = _dedupe_review_comments([_format_review_comment(comment) for comment in comments])
     
     # Create a review with comments in a single request
     # This is the recommended way according to GitHub API docs
     try:
-        review_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/reviews"
+        review_url = f"{pull_url}/reviews"
         
         review_data = {
             "commit_id": latest_commit_sha,
             "event": "COMMENT",  # Submit the review immediately as a COMMENT
-            "body": f"AI PR Review - I've reviewed the changes and left {len(comments)} specific comments on the code.",
+            "body": f"AI PR Review - I've reviewed the changes and left {len(formatted_comments)} specific comments on the code.",
             "comments": formatted_comments
         }
         
-        logger.info(f"Creating review with {len(formatted_comments)} comments")
-        logger.debug(f"Review data: commit_id={latest_commit_sha}, event=COMMENT, comments_count={len(formatted_comments)}")
+        logger.info("Creating review with %d comments", len(formatted_comments))
+        logger.debug("Review data: commit_id=%s, event=COMMENT, comments_count=%d",
+                     latest_commit_sha, len(formatted_comments))
         
         # Log a sample comment for debugging
         if formatted_comments:
             sample = formatted_comments[0]
-            logger.debug(f"Sample comment: path={sample['path']}, line={sample['line']}, side={sample['side']}")
+            logger.debug("Sample comment: path=%s, line=%s, side=%s",
+                         sample['path'], sample['line'], sample['side'])
             
-        review_response = requests.post(review_url, headers=headers, json=review_data)
+        review_response = _post_json(review_url, headers, review_data)
         
         # Check if the request was successful
         if review_response.status_code >= 400:
             error_body = review_response.text
-            logger.error(f"Failed to create review: HTTP {review_response.status_code}: {error_body}")
+            logger.error("Failed to create review: HTTP %s: %s", review_response.status_code, error_body)
+            
+            # GitHub rejects the whole review with 422 when any comment is
+            # invalid, so retry the comments one by one to post the valid
+            # ones; other errors would just repeat for every comment
+            if review_response.status_code != 422:
+                return False
             
-            # Try individual comments if bulk creation failed
             logger.info("Attempting to create review with comments one by one")
             return create_review_with_individual_comments(repo, pr_number, token, formatted_comments, latest_commit_sha)
         
         # Success!
-        review_id = review_response.json().get("id")
-        logger.info(f"Successfully created review #{review_id} with {len(formatted_comments)} comments")
+        review_id = _json(review_response).get("id")
+        logger.info("Successfully created review #%s with %d comments", review_id, len(formatted_comments))
         return True
             
     except Exception as e:
-        logger.error(f"Error creating review: {str(e)}", exc_info=True)
+        logger.error("Error creating review: %s", e, exc_info=True)
         return False
 
 
 def create_review_with_individual_comments(repo, pr_number, token, comments, commit_sha):
     """Helper function to create a review and add comments one by one."""
     headers = {
-        "Accept": "application/vnd.github.v3+json",
+        **_JSON_HEADERS,
         "Authorization": f"Bearer {token}",
         "X-GitHub-Api-Version": "2022-11-28"
     }
     
+    # Prepare every comment payload before making any request, so the
+    # posting phase below is I/O only
+    success = True
+    payloads = []
+    for i, comment in enumerate(comments):
+        try:
+            payloads.append((i, _format_review_comment(comment)))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("Invalid comment %d: %s", i + 1, e)
+            success = False
+    
     # First create a pending review
+    review_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/reviews"
     try:
-        review_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/reviews"
-        
         pending_data = {
             "commit_id": commit_sha,
             "event": "PENDING",
             "body": "AI PR review in progress..."
         }
         
-        pending_response = requests.post(review_url, headers=headers, json=pending_data)
+        pending_response = _post_json(review_url, headers, pending_data)
         pending_response.raise_for_status()
         
-        review_id = pending_response.json().get("id")
+        review_id = _json(pending_response).get("id")
         if not review_id:
             logger.error("Failed to get review ID from pending review response")
             return False
             
-        logger.debug(f"Created pending review with ID: {review_id}")
+        logger.debug("Created pending review with ID: %s", review_id)
     except Exception as e:
-        logger.error(f"Failed to create pending review: {str(e)}")
+        logger.error("Failed to create pending review: %s", e)
         return False
     
-    # Add comments one by one
-    comments_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/reviews/{review_id}/comments"
+    # Add the comments concurrently; the shared rate limiter still paces them
+    comments_url = f"{review_url}/{review_id}/comments"
     
-    success = True
-    for i, comment in enumerate(comments):
+    def add_comment(i: int, comment_data: Dict[str, Any]) -> bool:
         try:
-            # Each comment needs the commit_id
-            comment_data = {
-                "path": comment["path"],
-                "body": comment["body"],
-                "line": comment["line"],
-                "side": comment["side"]
-            }
+            logger.debug("Adding comment %d/%d: %s:%s", i + 1, len(comments),
+                         comment_data['path'], comment_data['line'])
             
-            # Add optional fields if present
-            if "start_line" in comment:
-                comment_data["start_line"] = comment["start_line"]
-                comment_data["start_side"] = comment.get("start_side", "RIGHT")
-            
-            logger.debug(f"Adding comment {i+1}/{len(comments)}: {comment['path']}:{comment['line']}")
-            
-            comment_response = requests.post(comments_url, headers=headers, json=comment_data)
+            # Pace the posts to avoid rate limits
+            _COMMENT_RATE_LIMITER.acquire()
+            comment_response = _post_json(comments_url, headers, comment_data)
             
             if comment_response.status_code >= 400:
-                logger.error(f"Failed to add comment {i+1}: HTTP {comment_response.status_code}: {comment_response.text}")
-                success = False
-            else:
-                logger.debug(f"Successfully added comment {i+1}/{len(comments)}")
-                
-            # Add a delay to avoid rate limits
-            time.sleep(0.5)
+                logger.error("Failed to add comment %d: HTTP %s: %s",
+                             i + 1, comment_response.status_code, comment_response.text)
+                return False
+            
+            logger.debug("Successfully added comment %d/%d", i + 1, len(comments))
+            return True
         except Exception as e:
-            logger.error(f"Error adding comment {i+1}: {str(e)}")
-            success = False
+            logger.error("Error adding comment %d: %s", i + 1, e)
+            return False
+    
+    with ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_POSTS) as executor:
+        futures = [executor.submit(add_comment, i, comment_data) for i, comment_data in payloads]
+        for future in as_completed(futures):
+            success = future.result() and success
     
     # Submit the review to publish the comments
     try:
-        submit_url = f"https://api.github.com/repos/{repo}/pulls/{pr_number}/reviews/{review_id}/events"
+        submit_url = f"{review_url}/{review_id}/events"
         
         submit_data = {
             "body": f"AI PR Review - I've reviewed the changes and left {len(comments)} specific comments on the code.",
             "event": "COMMENT"
         }
         
-        logger.info(f"Submitting review #{review_id}")
+        logger.info("Submitting review #%s", review_id)
         
-        submit_response = requests.post(submit_url, headers=headers, json=submit_data)
+        submit_response = _post_json(submit_url, headers, submit_data)
         
         if submit_response.status_code >= 400:
-            logger.error(f"Failed to submit review: HTTP {submit_response.status_code}: {submit_response.text}")
+            logger.error("Failed to submit review: HTTP %s: %s", submit_response.status_code, submit_response.text)
             return False
             
-        logger.info(f"Successfully submitted review with {len(comments)} comments")
+        logger.info("Successfully submitted review with %d comments", len(comments))
         return success
     except Exception as e:
-        logger.error(f"Failed to submit review: {str(e)}")
+        logger.error("Failed to submit review: %s", e)
         return False
 
 
+def _iter_lines(text: str) -> Iterator[str]:
+    """
+    Lazily iterate over the lines of a string without their trailing newlines.
+    
+    Unlike ``text.split('\\n')`` this never holds every line in memory at once,
+    and a trailing newline does not produce an extra empty line.
+    
+    Args:
+        text: The text to iterate over
+        
+    Returns:
+        Iterator over the lines of the text
+    """
+    pos = 0
+    end = len(text)
+    while pos < end:
+        newline = text.find('\n', pos)
+        if newline < 0:
+            yield text[pos:]
+            return
+        yield text[pos:newline]
+        pos = newline + 1
+
+
 def parse_diff_for_lines(diff_text: str) -> Dict[str, List[Tuple[int, int, str]]]:
     """
     Parse a diff to extract file paths and line numbers.
@@ -529,62 +1269,60 @@ def parse_diff_for_lines(diff_text: str) -> Dict[str, List[Tuple[int, int, str]]
     """
     result = {}
     current_file = None
+    append = None  # Bound ``append`` of the current file's line list
     line_number = 0
     position = 0  # Track position in the diff (still useful for debugging)
     
-    # Extract filename and line information from diff
-    lines = diff_text.split('\n')
-    
-    # Process the diff to extract file paths and line numbers
-    for line in lines:
-        # New file in diff
-        if line.startswith('diff --git'):
-            position = 0  # Reset position counter for each new file
-            continue
-            
-        # New file path
-        if line.startswith('+++'):
-            path_match = re.match(r'\+\+\+ b/(.*)', line)
-            if path_match:
-                current_file = path_match.group(1)
-                result[current_file] = []
-                line_number = 0
-                logger.debug(f"Processing file: {current_file}")
+    # Process the diff to extract file paths and line numbers, dispatching on
+    # the first character so plain content lines never touch the regex engine.
+    # Lines are read lazily instead of materializing the whole diff as a list.
+    for line in _iter_lines(diff_text):
+        marker = line[:1]
+        
+        # Addition lines (and the new file path marker)
+        if marker == '+':
             position += 1
-            continue
-            
-        # Skip old file path marker
-        if line.startswith('---'):
+            if line.startswith('+++'):
+                header = _DIFF_HEADER_RE.match(line)
+                if header and header.lastindex == 1:
+                    current_file = header.group(1)
+                    result[current_file] = []
+                    append = result[current_file].append
+                    line_number = 0
+                continue
+            if append is not None:
+                line_number += 1
+                append((line_number, position, line[1:]))
+        
+        # Context lines (blank lines are treated as empty context lines)
+        elif marker == ' ' or not marker:
             position += 1
-            continue
-            
+            if append is not None:
+                line_number += 1
+                append((line_number, position, line))
+        
         # Parse hunk header for line numbers
-        if line.startswith('@@'):
-            match = re.search(r'@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@', line)
-            if match:
-                line_number = int(match.group(1)) - 1  # -1 because we increment before using
-                logger.debug(f"Found hunk header, new line number start: {line_number + 1}")
+        elif marker == '@':
             position += 1
-            continue
-            
-        # Increment position for each line in the diff
-        position += 1
+            header = _DIFF_HEADER_RE.match(line)
+            if header and header.lastindex == 2:
+                line_number = int(header.group(2)) - 1  # -1 because we increment before using
         
-        # Skip removal lines (-)
-        if line.startswith('-'):
-            continue
-            
-        # Process addition and context lines
-        if line.startswith('+') or not line.startswith('\\'):  # Skip "No newline" markers
-            if current_file:
-                line_number += 1
-                content = line[1:] if line.startswith('+') else line
-                # Store line number, position, and content
-                result[current_file].append((line_number, position, content))
+        # New file in diff
+        elif marker == 'd' and line.startswith('diff --git'):
+            position = 0  # Reset position counter for each new file
+            current_file = None
+            append = None
+        
+        # Removal lines, old file path markers, "No newline" markers and
+        # extended headers (index, mode, rename) only advance the position
+        else:
+            position += 1
     
-    # Log file mapping summary
-    for file_path, lines in result.items():
-        logger.debug(f"Mapped {len(lines)} lines for file {file_path}")
+    # Log the file mapping once at the end rather than from the per-line loop
+    if logger.isEnabledFor(logging.DEBUG):
+        for file_path, lines in result.items():
+            logger.debug("Mapped %d lines for file %s", len(lines), file_path)
     
     return result
 
@@ -600,10 +1338,32 @@ def extract_code_blocks(text: str) -> List[str]:
         List of code blocks without the markdown backticks
     """
     code_blocks = []
-    pattern = r'```(?:\w+)?\n(.*?)```'
-    matches = re.finditer(pattern, text, re.DOTALL)
+    position = 0
     
-    for match in matches:
-        code_blocks.append(match.group(1).strip())
+    # Scan fence to fence with str.find instead of a DOTALL regex, which
+    # backtracks over the whole remaining text for every unclosed fence
+    while True:
+        start = text.find('```', position)
+        if start < 0:
+            break
+        
+        # Only a fence at the start of a line (possibly indented, e.g. in a
+        # list) opens a block; inline ``` spans in prose are skipped
+        line_start = text.rfind('\n', 0, start) + 1
+        if text[line_start:start].strip():
+            position = start + 3
+            continue
+        
+        # The block starts on the line after the opening fence and language tag
+        content_start = text.find('\n', start + 3)
+        if content_start < 0:
+            break
+        
+        end = text.find('```', content_start + 1)
+        if end < 0:
+            break
+        
+        code_blocks.append(text[content_start + 1:end].strip())
+        position = end + 3
     
     return code_blocks
\ No newline at end of file
@@ -129,6 +129,17 @@ This function is missing proper error handling.
         # Invalid file path
         self.assertFalse(extractor.validate_line_number("src/nonexistent.py", 1, self.file_line_map))
 
+    def test_validate_line_number_entry_shapes(self):
+        """Test validation against both (line, position) and (line, position, content) entries."""
+        extractor = CommentExtractor(config_path=self.temp_config_file.name)
+        
+        pairs = {"a.py": [(3, 4), (5, 6)]}
+        triples = {"a.py": [(3, 4, "x = 1"), (5, 6, "y = 2")]}
+        
+        for file_line_map in (pairs, triples):
+            self.assertTrue(extractor.validate_line_number("a.py", 5, file_line_map))
+            self.assertFalse(extractor.validate_line_number("a.py", 4, file_line_map))
+
     def test_match_comment_patterns(self):
         """Test matching comment patterns in review text."""
         extractor = CommentExtractor(config_path=self.temp_config_file.name)
@@ -158,6 +169,16 @@ This function is missing proper error handling.
         comment_text = extractor.extract_comment_text(self.review_text, matches[1])
         self.assertEqual(comment_text, "The variable name 'value' is too generic. Consider using a more descriptive name.")
 
+    def test_extract_comment_text_stops_at_adjacent_match(self):
+        """Test that a comment ends at a next match that starts right after it."""
+        extractor = CommentExtractor(config_path=self.temp_config_file.name)
+        review_text = "a.py:1: Fix\nb.py:2: Also fix"
+        first_match = extractor.compiled_patterns[1].search(review_text)
+        
+        comment_text = extractor.extract_comment_text(review_text, {"match": first_match})
+        
+        self.assertEqual(comment_text, "Fix")
+
     def test_extract_line_comments(self):
         """Test extracting all line comments from review text."""
         extractor = CommentExtractor(config_path=self.temp_config_file.name)
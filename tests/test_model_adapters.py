@@ -3,8 +3,9 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 import responses
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, ReadTimeoutError
 
-from src.model_adapters import ModelAdapter
+from src.model_adapters import ModelAdapter, _ModelRetry
 
 
 class TestModelAdapter(unittest.TestCase):
@@ -43,6 +44,23 @@ class TestModelAdapter(unittest.TestCase):
         adapter = ModelAdapter(config)
         self.assertEqual(adapter.api_key, "env-key-openai")
 
+    def test_model_retry_only_retries_unprocessed_posts(self):
+        """Test that billed POSTs are retried only when the provider did not run them."""
+        retry = _ModelRetry(total=3, read=0, status_forcelist=[429, 503],
+                            allowed_methods=frozenset(["POST"]))
+        
+        self.assertTrue(retry.is_retry("POST", 429))
+        self.assertTrue(retry.is_retry("POST", 503, has_retry_after=True))
+        self.assertFalse(retry.is_retry("POST", 503))
+        self.assertFalse(retry.is_retry("POST", 502))
+        self.assertFalse(retry.is_retry("POST", 504))
+        self.assertFalse(retry.is_retry("POST", 413, has_retry_after=True))
+        self.assertFalse(
+            retry.increment("POST", "/", error=ConnectTimeoutError("timed out")).is_exhausted()
+        )
+        with self.assertRaises(MaxRetryError):
+            retry.increment("POST", "/", error=ReadTimeoutError(None, "/", "timed out"))
+
     def test_init_missing_api_key(self):
         """Test that ValueError is raised if API key is missing."""
         config = self.openai_config.copy()
@@ -1,16 +1,35 @@
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import Future
+from pathlib import Path
 from unittest.mock import patch, MagicMock
 
 import pytest
 import responses
 
 from src.utils import (
+    clear_cache,
     get_pr_diff,
+    get_pr_files,
+    invalidate_pr_cache,
     post_review_comment,
+    post_line_comments,
     parse_diff_for_lines,
-    extract_code_blocks
+    extract_code_blocks,
+    _truncate,
+    _ETAG_CACHE,
+    _cache_path,
+    _load_cached,
+    _store_cached,
+    _GitHubRetry,
+    _RateLimitGuard,
+    _RateLimiter
 )
-from src.review_pr import extract_line_comments
+from src.comment_extractor import extract_line_comments
 
 
 class TestUtilFunctions(unittest.TestCase):
@@ -21,6 +40,16 @@ class TestUtilFunctions(unittest.TestCase):
         self.repo = "test-owner/test-repo"
         self.pr_number = "123"
         self.token = "test-token"
+        
+        # Keep the ETag cache of each test separate
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_patcher = patch("src.utils._CACHE_DIR", Path(cache_dir.name))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        memory_cache_patcher = patch.dict("src.utils._ETAG_CACHE", clear=True)
+        memory_cache_patcher.start()
+        self.addCleanup(memory_cache_patcher.stop)
         self.sample_diff = """diff --git a/src/test.py b/src/test.py
 index abcdef..ghijkl 100644
 --- a/src/test.py
@@ -68,6 +97,186 @@ index abcdef..ghijkl 100644
         
         self.assertIsNone(diff)
 
+    @responses.activate
+    def test_get_pr_diff_falls_back_to_files(self):
+        """Test that the diff is rebuilt from file patches when GitHub cannot render it."""
+        responses.add(
+            responses.GET,
+            f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}",
+            json={"message": "Sorry, the diff exceeded the maximum number of lines"},
+            status=406
+        )
+        responses.add(
+            responses.GET,
+            f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}/files",
+            json=[
+                {"filename": "src/test.py", "patch": "@@ -1 +1 @@\n-old\n+new"},
+                {"filename": "image.png"}
+            ],
+            status=200
+        )
+        
+        diff = get_pr_diff(self.repo, self.pr_number, self.token)
+        
+        self.assertEqual(diff, (
+            "diff --git a/src/test.py b/src/test.py\n"
+            "--- a/src/test.py\n"
+            "+++ b/src/test.py\n"
+            "@@ -1 +1 @@\n-old\n+new"
+        ))
+        self.assertEqual(parse_diff_for_lines(diff), {"src/test.py": [(1, 5, "new")]})
+
+    @responses.activate
+    def test_get_pr_diff_uses_etag_cache(self):
+        """Test that an unchanged diff is revalidated with its ETag and served from the cache."""
+        url = f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}"
+        responses.add(
+            responses.GET,
+            url,
+            body=self.sample_diff,
+            headers={"ETag": '"abc123"'},
+            status=200
+        )
+        responses.add(responses.GET, url, status=304)
+        
+        first = get_pr_diff(self.repo, self.pr_number, self.token)
+        second = get_pr_diff(self.repo, self.pr_number, self.token)
+        
+        self.assertEqual(first, self.sample_diff)
+        self.assertEqual(second, self.sample_diff)
+        self.assertNotIn("If-None-Match", responses.calls[0].request.headers)
+        self.assertEqual(responses.calls[1].request.headers["If-None-Match"], '"abc123"')
+
+    def test_invalidate_pr_cache_spares_repos_sharing_a_prefix(self):
+        """Test that invalidating PR 1 of o/r keeps the cache of PR 5 of o/r-1."""
+        _store_cached("o/r", "1", "diff", '"a"', "diff a")
+        _store_cached("o/r", "1", "files-2", '"b"', {"files": [], "next": None})
+        _store_cached("o/r-1", "5", "diff", '"c"', "diff c")
+        
+        invalidate_pr_cache("o/r", "1")
+        _ETAG_CACHE.clear()  # Read what is left from the cache files
+        
+        self.assertIsNone(_load_cached("o/r", "1", "diff"))
+        self.assertIsNone(_load_cached("o/r", "1", "files-2"))
+        self.assertEqual(_load_cached("o/r-1", "5", "diff")["body"], "diff c")
+
+    def test_get_pr_diff_coalesces_concurrent_calls(self):
+        """Test that concurrent fetches of the same diff share a single request."""
+        started = threading.Event()
+        waiting = threading.Event()
+        release = threading.Event()
+        results = []
+        
+        def fetch(*args):
+            started.set()
+            release.wait(5)
+            return self.sample_diff
+        
+        class SignallingFuture(Future):
+            def result(self, timeout=None):
+                waiting.set()
+                return super().result(timeout)
+        
+        def run():
+            results.append(get_pr_diff(self.repo, self.pr_number, self.token))
+        
+        with patch("src.utils._fetch_pr_diff", side_effect=fetch) as mock_fetch, \
+                patch("src.utils.Future", SignallingFuture):
+            threads = [threading.Thread(target=run) for _ in range(2)]
+            threads[0].start()
+            self.assertTrue(started.wait(5))
+            threads[1].start()
+            self.assertTrue(waiting.wait(5))
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(results, [self.sample_diff, self.sample_diff])
+
+    @responses.activate
+    def test_clear_cache_keeps_cache_files(self):
+        """Test that clearing the in-memory cache still revalidates from disk."""
+        url = f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}"
+        responses.add(
+            responses.GET,
+            url,
+            body=self.sample_diff,
+            headers={"ETag": '"abc123"'},
+            status=200
+        )
+        responses.add(responses.GET, url, status=304)
+        
+        get_pr_diff(self.repo, self.pr_number, self.token)
+        clear_cache()
+        
+        self.assertFalse(_ETAG_CACHE)
+        self.assertTrue(os.path.exists(_cache_path(self.repo, self.pr_number, "diff")))
+        
+        diff = get_pr_diff(self.repo, self.pr_number, self.token)
+        
+        self.assertEqual(diff, self.sample_diff)
+        self.assertEqual(responses.calls[1].request.headers["If-None-Match"], '"abc123"')
+
+    def test_store_cached_prunes_expired_files(self):
+        """Test that the first cache write of a process deletes expired cache files."""
+        _store_cached("o/r", "1", "diff", '"a"', "old diff")
+        expired = _cache_path("o/r", "1", "diff")
+        week_ago = time.time() - 8 * 24 * 3600
+        os.utime(expired, (week_ago, week_ago))
+        
+        with patch("src.utils._CACHE_PRUNED", threading.Event()):
+            _store_cached("o/r", 2, "diff", '"b"', "new diff")
+        
+        self.assertFalse(expired.exists())
+        self.assertTrue(_cache_path("o/r", "2", "diff").exists())
+        self.assertEqual(_load_cached("o/r", "2", "diff")["body"], "new diff")
+
+    @responses.activate
+    def test_invalidate_pr_cache(self):
+        """Test that an invalidated diff is downloaded again without revalidation."""
+        url = f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}"
+        responses.add(
+            responses.GET,
+            url,
+            body=self.sample_diff,
+            headers={"ETag": '"abc123"'},
+            status=200
+        )
+        
+        get_pr_diff(self.repo, self.pr_number, self.token)
+        invalidate_pr_cache(self.repo, self.pr_number)
+        get_pr_diff(self.repo, self.pr_number, self.token)
+        
+        self.assertEqual(len(responses.calls), 2)
+        self.assertNotIn("If-None-Match", responses.calls[1].request.headers)
+
+    @responses.activate
+    def test_get_pr_files_follows_pagination(self):
+        """Test that every page of changed files is fetched."""
+        url = f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}/files"
+        responses.add(
+            responses.GET,
+            f"{url}?per_page=100",
+            json=[{"filename": f"src/file{i}.py"} for i in range(100)],
+            headers={"Link": f'<{url}?per_page=100&page=2>; rel="next", <{url}?per_page=100&page=2>; rel="last"'},
+            match=[responses.matchers.query_param_matcher({"per_page": "100"})],
+            status=200
+        )
+        responses.add(
+            responses.GET,
+            f"{url}?per_page=100&page=2",
+            json=[{"filename": "README.md"}],
+            match=[responses.matchers.query_param_matcher({"per_page": "100", "page": "2"})],
+            status=200
+        )
+        
+        files = get_pr_files(self.repo, self.pr_number, self.token)
+        
+        self.assertEqual(len(files), 101)
+        self.assertEqual(files[-1]["filename"], "README.md")
+        self.assertEqual(len(responses.calls), 2)
+
     @responses.activate
     def test_post_review_comment_success(self):
         """Test successful posting of review comment."""
@@ -89,6 +298,23 @@ index abcdef..ghijkl 100644
         self.assertIn(review_text, request_body)
         self.assertIn("COMMENT", request_body)
 
+    @responses.activate
+    def test_post_review_comment_truncates_long_review(self):
+        """Test that a review longer than GitHub allows is truncated."""
+        responses.add(
+            responses.POST,
+            f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}/reviews",
+            json={"id": 123456},
+            status=201
+        )
+        
+        success = post_review_comment(self.repo, self.pr_number, self.token, "x" * 70000)
+        
+        self.assertTrue(success)
+        body = json.loads(responses.calls[0].request.body)["body"]
+        self.assertEqual(body, _truncate("x" * 70000))
+        self.assertLess(len(body), 65536)
+
     @responses.activate
     def test_post_review_comment_failure(self):
         """Test failure in posting review comment."""
@@ -104,6 +330,76 @@ index abcdef..ghijkl 100644
         
         self.assertFalse(success)
 
+    @responses.activate
+    def test_post_line_comments_payload(self):
+        """Test that line comments are posted once each in a single review with API fields only."""
+        responses.add(
+            responses.GET,
+            f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}",
+            json={"head": {"sha": "abc123"}},
+            status=200
+        )
+        responses.add(
+            responses.POST,
+            f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}/reviews",
+            json={"id": 1},
+            status=200
+        )
+        comments = [
+            {"path": "src/test.py", "line": 13, "side": "RIGHT", "body": "First"},
+            {"path": "src/test.py", "line": "14", "position": 6, "body": "Second"},
+            {"path": "src/test.py", "line": 13, "body": "First"}
+        ]
+        
+        success = post_line_comments(self.repo, self.pr_number, self.token, comments)
+        
+        self.assertTrue(success)
+        payload = json.loads(responses.calls[1].request.body)
+        self.assertEqual(payload["commit_id"], "abc123")
+        self.assertEqual(payload["comments"], [
+            {"path": "src/test.py", "line": 13, "side": "RIGHT", "body": "First"},
+            {"path": "src/test.py", "line": 14, "side": "RIGHT", "body": "Second"}
+        ])
+
+    @responses.activate
+    @patch("src.utils._COMMENT_RATE_LIMITER")
+    def test_post_line_comments_falls_back_to_individual_comments(self, mock_limiter):
+        """Test that every comment is added to a pending review when the bulk review is rejected."""
+        base_url = f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}"
+        responses.add(responses.GET, base_url, json={"head": {"sha": "abc123"}}, status=200)
+        responses.add(responses.POST, f"{base_url}/reviews", json={"message": "Unprocessable"}, status=422)
+        responses.add(responses.POST, f"{base_url}/reviews", json={"id": 7}, status=200)
+        responses.add(responses.POST, f"{base_url}/reviews/7/comments", json={}, status=201)
+        responses.add(responses.POST, f"{base_url}/reviews/7/events", json={}, status=200)
+        comments = [
+            {"path": "src/test.py", "line": line, "side": "RIGHT", "body": f"Comment {line}"}
+            for line in range(10, 15)
+        ]
+        
+        success = post_line_comments(self.repo, self.pr_number, self.token, comments)
+        
+        self.assertTrue(success)
+        posted = sorted(
+            json.loads(call.request.body)["line"]
+            for call in responses.calls
+            if call.request.url.endswith("/reviews/7/comments")
+        )
+        self.assertEqual(posted, list(range(10, 15)))
+        self.assertTrue(responses.calls[-1].request.url.endswith("/reviews/7/events"))
+
+    @responses.activate
+    def test_post_line_comments_does_not_fall_back_on_auth_errors(self):
+        """Test that comments are not posted one by one when the review fails for other reasons."""
+        base_url = f"https://api.github.com/repos/{self.repo}/pulls/{self.pr_number}"
+        responses.add(responses.GET, base_url, json={"head": {"sha": "abc123"}}, status=200)
+        responses.add(responses.POST, f"{base_url}/reviews", json={"message": "Bad credentials"}, status=401)
+        comments = [{"path": "src/test.py", "line": 13, "side": "RIGHT", "body": "First"}]
+        
+        success = post_line_comments(self.repo, self.pr_number, self.token, comments)
+        
+        self.assertFalse(success)
+        self.assertEqual(len(responses.calls), 2)
+
     def test_parse_diff_for_lines(self):
         """Test parsing diff to extract file paths and line numbers."""
         result = parse_diff_for_lines(self.sample_diff)
@@ -121,6 +417,101 @@ index abcdef..ghijkl 100644
         self.assertEqual(lines[1][0], 14)  # Line number
         self.assertEqual(lines[1][1], "    value = 42")  # Line content
 
+    def test_parse_diff_for_lines_multiple_files(self):
+        """Test that lines are attributed to the right file in a multi-file diff."""
+        diff = (
+            "diff --git a/a.py b/a.py\n"
+            "index 111..222 100644\n"
+            "--- a/a.py\n"
+            "+++ b/a.py\n"
+            "@@ -1,2 +1,3 @@\n"
+            " first\n"
+            "-old\n"
+            "+new\n"
+            "+newer\n"
+            "diff --git a/b.py b/b.py\n"
+            "new file mode 100644\n"
+            "index 000..333\n"
+            "--- /dev/null\n"
+            "+++ b/b.py\n"
+            "@@ -0,0 +5,1 @@\n"
+            "+added"
+        )
+        
+        result = parse_diff_for_lines(diff)
+        
+        self.assertEqual([line for line, _, _ in result["a.py"]], [1, 2, 3])
+        self.assertEqual([content for _, _, content in result["a.py"]], [" first", "new", "newer"])
+        self.assertEqual(result["b.py"], [(5, 6, "added")])
+
+    @patch("src.utils.time.time", return_value=1000.0)
+    @patch("src.utils.time.sleep")
+    def test_rate_limit_guard(self, mock_sleep, mock_time):
+        """Test that the rate limit guard paces writes when the budget is low and waits for the reset when it is spent."""
+        guard = _RateLimitGuard()
+        response = MagicMock()
+        
+        response.headers = {"X-RateLimit-Remaining": "500", "X-RateLimit-Reset": "1100"}
+        guard.update(response)
+        guard.wait_if_low()
+        mock_sleep.assert_not_called()
+        
+        response.headers = {"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "1100"}
+        guard.update(response)
+        guard.wait_if_low(pace=False)
+        mock_sleep.assert_not_called()
+        guard.wait_if_low()
+        mock_sleep.assert_called_once_with(10.0)
+        
+        response.headers = {"X-RateLimit-Remaining": "3", "X-RateLimit-Reset": "1100"}
+        guard.update(response)
+        guard.wait_if_low()
+        mock_sleep.assert_called_with(_RateLimitGuard.MAX_PACING_DELAY)
+        
+        response.headers = {"X-RateLimit-Remaining": "1", "X-RateLimit-Reset": "1100"}
+        guard.update(response)
+        guard.wait_if_low(pace=False)
+        mock_sleep.assert_called_with(100.0)
+
+    def test_github_retry_honours_retry_after(self):
+        """Test that Retry-After sets the retry delay, plus at most a second of jitter."""
+        retry = _GitHubRetry(total=3, backoff_factor=0.5)
+        response = MagicMock()
+        response.headers = {"Retry-After": "2"}
+        
+        delay = retry.get_retry_after(response)
+        
+        self.assertGreaterEqual(delay, 2)
+        self.assertLessEqual(delay, 3)
+        response.headers = {}
+        self.assertIsNone(retry.get_retry_after(response))
+
+    def test_rate_limiter_adapts_to_throttling(self):
+        """Test that the comment rate halves on throttling and recovers additively."""
+        limiter = _RateLimiter(rate=4, min_rate=0.5, increase=1)
+        
+        limiter.record(throttled=True)
+        self.assertEqual(limiter._rate, 2)
+        limiter.record(throttled=True)
+        limiter.record(throttled=True)
+        limiter.record(throttled=True)
+        self.assertEqual(limiter._rate, 0.5)
+        limiter.record(throttled=False)
+        self.assertEqual(limiter._rate, 1.5)
+        for _ in range(5):
+            limiter.record(throttled=False)
+        self.assertEqual(limiter._rate, 4)
+
+    def test_truncate(self):
+        """Test that only over-long comment text is truncated."""
+        short_text = "x" * 10
+        
+        self.assertIs(_truncate(short_text, limit=10), short_text)
+        self.assertEqual(
+            _truncate("x" * 11, limit=10),
+            "x" * 10 + "\n\n*(Comment truncated due to length)*"
+        )
+
     def test_extract_code_blocks(self):
         """Test extracting code blocks from markdown text."""
         markdown_text = """
@@ -145,6 +536,20 @@ function add(a, b) {
         self.assertEqual(blocks[0], "def test_function():\n    return 42")
         self.assertEqual(blocks[1], "function add(a, b) {\n    return a + b;\n}")
     
+    def test_extract_code_blocks_unusual_fences(self):
+        """Test code blocks with non-word language tags and unclosed fences."""
+        markdown_text = "```c++\nint x = 0;\n```\n\n```python\nunclosed = True\n"
+        
+        blocks = extract_code_blocks(markdown_text)
+        
+        self.assertEqual(blocks, ["int x = 0;"])
+    
+    def test_extract_code_blocks_ignores_inline_fences(self):
+        """Test that triple backticks inside a line do not open a code block."""
+        blocks = extract_code_blocks("use ```x``` then\n```py\ncode\n```")
+        
+        self.assertEqual(blocks, ["code"])
+    
     def test_extract_line_comments(self):
         """Test extracting line-specific comments from review text."""
         review_text = """